@@ -781,6 +781,16 @@ class ControlServerHandler(BasicAuthMixIn, RequestHandler):
                 'data':    '%s: %s' % (type(e).__name__, str(e)),
             })
 
+        if isinstance(request, list):
+            # JSON-RPC 2.0 batch: dispatch the calls in order and
+            # answer them with a single response array
+            responses = [self._dispatch(req) for req in request]
+            self.set_header('Content-Type', 'application/json')
+            return self.finish(json.dumps(responses))
+        return self.finish(self._dispatch(request))
+
+    def _dispatch(self, request):
+        id_ = None
         try:
             id_ = request.get('id')
             params = request.get('params')
@@ -789,7 +799,7 @@ class ControlServerHandler(BasicAuthMixIn, RequestHandler):
             if version != '2.0':
                 raise ValueError('Invalid JSON-RPC version: %s' % version)
         except Exception as e:
-            return self._jsonrpc_response(id_=id_, error={
+            return self._jsonrpc_result(id_=id_, error={
                 'code':    0 - 32600,
                 'message': 'Invalid Request',
                 'data':    '%s: %s' % (type(e).__name__, str(e)),
@@ -801,17 +811,17 @@ class ControlServerHandler(BasicAuthMixIn, RequestHandler):
             handler = 'handle_' + method[len(self.NAMESPACE) + 1:]
             handler = getattr(self, handler)
         except Exception as e:
-            return self._jsonrpc_response(id_=id_, error={
+            return self._jsonrpc_result(id_=id_, error={
                 'code':    0 - 32601,
                 'message': 'Method not found',
                 'data':    '%s: %s' % (type(e).__name__, str(e)),
             })
 
         try:
-            return self._jsonrpc_response(id_=id_, result=handler(params))
+            return self._jsonrpc_result(id_=id_, result=handler(params))
         except Exception as e:
             self._logger.exception('caught error while processing request')
-            return self._jsonrpc_response(id_=id_, error={
+            return self._jsonrpc_result(id_=id_, error={
                 'code':    0 - 32602,
                 'message': 'Invalid params',
                 'data':     '%s: %s' % (type(e).__name__, str(e)),
@@ -889,13 +899,17 @@ class ControlServerHandler(BasicAuthMixIn, RequestHandler):
         cred = {'user': opt.get('user'), 'passwd': opt.get('passwd')}
         return {'sslopt': sslopt, 'cred': cred}
 
-    def _jsonrpc_response(self, id_=None, result=None, error=None):
+    @staticmethod
+    def _jsonrpc_result(id_=None, result=None, error=None):
         res = {'jsonrpc': '2.0', 'id': id_}
         if result:
             res['result'] = result
         if error:
             res['error'] = error
-        self.finish(res)
+        return res
+
+    def _jsonrpc_response(self, id_=None, result=None, error=None):
+        self.finish(self._jsonrpc_result(id_=id_, result=result, error=error))
 
     @staticmethod
     def _portstat(port):
@@ -2,8 +2,11 @@
 
 # General imports
 import pyroute2
+import json
 import logging
 import pynat
+import threading
+from http.client import HTTPConnection, HTTPException
 from socket import AF_INET, AF_INET6
 # ipaddress dependencies
 from ipaddress import IPv6Network, IPv4Network
@@ -25,6 +28,51 @@ except ModuleNotFoundError:
 # Global variables
 NO_SUCH_FILE_OR_DIRECTORY = 2
 
+# NAT types supported by the etherws tunnel mode; bound once at module
+# scope so instantiations skip the pynat attribute lookups
+_NAT_TYPES = (
+    pynat.OPEN,
+    pynat.FULL_CONE,
+    pynat.RESTRICTED_CONE,
+    pynat.RESTRICTED_PORT,
+    pynat.SYMMETRIC,
+    pynat.UDP_FIREWALL,
+    pynat.BLOCKED,
+)
+
+# Cache mapping an allocated net (in string form) to the derived
+# (controller VTEP IP, device VTEP IP, prefix length) tuple
+_VTEP_CACHE = dict()
+# Max number of entries kept in the VTEP cache
+VTEP_CACHE_MAXSIZE = 1024
+
+
+def _vteps_from_net(net, family):
+    # Derive the controller and device VTEP IPs from an allocated net
+    #
+    # Indexing an IPv4Network/IPv6Network (net[1], net[2]) rebuilds an
+    # address object from the base integer on every access; compute the
+    # addresses once with integer arithmetic and memoize the result so
+    # repeated allocations of the same net skip the parsing entirely
+    vteps = _VTEP_CACHE.get(net)
+    if vteps is not None:
+        return vteps
+    if family == AF_INET6:
+        parsed = IPv6Network(net)
+    else:
+        parsed = IPv4Network(net)
+    addr_cls = type(parsed.network_address)
+    base = int(parsed.network_address)
+    vteps = (
+        str(addr_cls(base + 1)),
+        str(addr_cls(base + 2)),
+        parsed.prefixlen
+    )
+    if len(_VTEP_CACHE) >= VTEP_CACHE_MAXSIZE:
+        _VTEP_CACHE.clear()
+    _VTEP_CACHE[net] = vteps
+    return vteps
+
 
 '''
 Classes and helper functions used to interact with the etherws library
@@ -32,29 +80,41 @@ Classes and helper functions used to interact with the etherws library
 
 
 class Args:
-    pass
+    __slots__ = ()
 
 
 class SwArgs(Args):
-    debug = False
-    logconf = None
-    foreground = False
-    ageout = 300
-    path = '/'
-    host = ''
-    port = None
-    htpasswd = None
-    sslkey = None
-    sslcert = None
-    ctlpath = '/ctl'
-    ctlhost = '127.0.0.1'
-    ctlport = 7867
-    ctlhtpasswd = None
-    ctlsslkey = None
-    ctlsslkey = None
+
+    # The switch settings are mutated by etherws._start_sw
+    # (e.g. the default ports are filled in), so they are kept
+    # per-instance in slots
+    __slots__ = (
+        'debug', 'logconf', 'foreground', 'ageout', 'path', 'host',
+        'port', 'htpasswd', 'sslkey', 'sslcert', 'ctlpath', 'ctlhost',
+        'ctlport', 'ctlhtpasswd', 'ctlsslkey', 'ctlsslcert'
+    )
+
+    def __init__(self):
+        self.debug = False
+        self.logconf = None
+        self.foreground = False
+        self.ageout = 300
+        self.path = '/'
+        self.host = ''
+        self.port = None
+        self.htpasswd = None
+        self.sslkey = None
+        self.sslcert = None
+        self.ctlpath = '/ctl'
+        self.ctlhost = '127.0.0.1'
+        self.ctlport = 7867
+        self.ctlhtpasswd = None
+        self.ctlsslkey = None
+        self.ctlsslcert = None
 
 
 class CtlArgs(Args):
+    __slots__ = ()
     ctlurl = 'http://127.0.0.1:7867/ctl'
     ctluser = None
     ctlpasswd = None
@@ -63,80 +123,238 @@ class CtlArgs(Args):
 
 
 class CtlAddPortArgs(CtlArgs):
+    __slots__ = ()
     control_method = 'addport'
 
 
 class CtlAddPortNetDevArgs(CtlAddPortArgs):
+    __slots__ = ('target',)
     iftype = etherws.NetdevHandler.IFTYPE
-    target = None
+
+    def __init__(self, target=None):
+        self.target = target
 
 
 class CtlAddPortTapArgs(CtlAddPortArgs):
+    __slots__ = ('target',)
     iftype = etherws.TapHandler.IFTYPE
-    target = None
+
+    def __init__(self, target=None):
+        self.target = target
 
 
 class CtlAddPortClientArgs(CtlAddPortArgs):
+    __slots__ = ('target', 'user', 'passwd', 'cacerts', 'insecure')
     iftype = etherws.ClientHandler.IFTYPE
-    target = None
-    user = None
-    passwd = None
-    cacerts = None
-    insecure = False
+
+    def __init__(self, target=None):
+        self.target = target
+        self.user = None
+        self.passwd = None
+        self.cacerts = None
+        self.insecure = False
 
 
 class CtlSetPortArgs(CtlArgs):
+    __slots__ = ('port', 'shut')
     control_method = 'setport'
-    port = None
-    shut = None
+
+    def __init__(self, port=None, shut=None):
+        self.port = port
+        self.shut = shut
 
 
 class CtlDelPortArgs(CtlArgs):
+    __slots__ = ('port',)
     control_method = 'delport'
-    port = None
+
+    def __init__(self, port=None):
+        self.port = port
 
 
 class CtlListPortArgs(CtlArgs):
+    __slots__ = ()
     control_method = 'listport'
 
 
 class CtlSetIfArgs(CtlArgs):
+    __slots__ = ('port', 'address', 'netmask', 'mtu')
     control_method = 'setif'
-    port = None
-    address = None
-    netmask = None
-    mtu = None
+
+    def __init__(self, port=None, address=None, netmask=None, mtu=None):
+        self.port = port
+        self.address = address
+        self.netmask = netmask
+        self.mtu = mtu
 
 
 class CtlListIfPortArgs(CtlArgs):
+    __slots__ = ()
     control_method = 'listif'
 
 
 class CtlListFdbPortArgs(CtlArgs):
+    __slots__ = ()
     control_method = 'listfdb'
 
 
+# Host of the etherws control API
+CTL_HOST = '127.0.0.1'
+# Port of the etherws control API
+CTL_PORT = 7867
+# HTTP path of the etherws control API
+CTL_PATH = '/ctl'
+
+# Persistent HTTP connection to the etherws control API,
+# lazily initialized by _get_ctl_connection()
+_ctl_connection = None
+# Lock serializing the requests sent over the control connection
+_ctl_lock = threading.Lock()
+
+
+def _get_ctl_connection():
+    # Return the persistent HTTP connection to the etherws control API;
+    # keeping the connection alive avoids a TCP handshake and teardown
+    # on every control operation
+    global _ctl_connection
+    if _ctl_connection is None:
+        _ctl_connection = HTTPConnection(CTL_HOST, CTL_PORT)
+    return _ctl_connection
+
+
+def _close_ctl_connection():
+    global _ctl_connection
+    if _ctl_connection is not None:
+        _ctl_connection.close()
+        _ctl_connection = None
+
+
+def _ctl_post(payload):
+    # Send a JSON payload to the etherws control API over the
+    # persistent connection and return the raw response body
+    body = json.dumps(payload).encode()
+    headers = {'Content-Type': 'application/json'}
+    with _ctl_lock:
+        try:
+            connection = _get_ctl_connection()
+            connection.request('POST', CTL_PATH, body, headers)
+            response = connection.getresponse().read()
+        except (HTTPException, OSError):
+            # The keep-alive connection went stale (e.g. the etherws
+            # switch restarted); reconnect and retry once
+            _close_ctl_connection()
+            connection = _get_ctl_connection()
+            connection.request('POST', CTL_PATH, body, headers)
+            response = connection.getresponse().read()
+    return response
+
+
+# Per-thread pool of JSON-RPC request dicts, reused across control
+# calls; a request is serialized before the next call is built, so the
+# pooled dicts can be overwritten in place
+_request_pool = threading.local()
+
+
+def _jsonrpc_request(method, params, reqid):
+    try:
+        pool = _request_pool.requests
+    except AttributeError:
+        pool = _request_pool.requests = []
+    while len(pool) <= reqid:
+        pool.append({'jsonrpc': '2.0'})
+    request = pool[reqid]
+    request['method'] = '%s.%s' % (
+        etherws.ControlServerHandler.NAMESPACE, method
+    )
+    request['id'] = reqid
+    if params is not None:
+        request['params'] = params
+    else:
+        request.pop('params', None)
+    return request
+
+
+def _ctl_call(method, params=None):
+    # Issue a JSON-RPC request to the etherws control API over the
+    # persistent connection and return the parsed response
+    #
+    # This replaces the etherws._start_ctl() path, which rebuilt the
+    # request from an argparse-style object and opened a fresh HTTP
+    # connection on every call
+    response = json.loads(_ctl_post(_jsonrpc_request(method, params, 0)))
+    if 'error' in response:
+        logging.error(
+            'Error in etherws ctl request %s: %s', method, response['error']
+        )
+    return response
+
+
+def _ctl_batch(*calls):
+    # Issue several JSON-RPC requests to the etherws control API with a
+    # single HTTP roundtrip (JSON-RPC 2.0 batch); each call is a
+    # (method, params) pair and the responses are returned in call order
+    payload = [
+        _jsonrpc_request(method, params, reqid)
+        for reqid, (method, params) in enumerate(calls)
+    ]
+    responses = sorted(json.loads(_ctl_post(payload)), key=lambda r: r['id'])
+    for (method, _), response in zip(calls, responses):
+        if 'error' in response:
+            logging.error(
+                'Error in etherws ctl request %s: %s',
+                method, response['error']
+            )
+    return responses
+
+
+def _port_from_reply(reply):
+    # Extract the allocated port number from an addPort control reply;
+    # return None if the reply does not carry one (e.g. on error)
+    entries = reply.get('result', {}).get('entries', [])
+    if len(entries) == 0:
+        return None
+    return entries[0].get('port')
+
+
+# Module-level switch settings, built once and reused by start_etherws;
+# not frozen because etherws._start_sw fills in the defaulted fields
+# (e.g. the listening ports) in place
+_SW_ARGS = SwArgs()
+
+
 def start_etherws():
-    sw_args = SwArgs()
-    etherws._start_sw(sw_args)
+    etherws._start_sw(_SW_ARGS)
+
+
+def _tap_port_params(device):
+    return {'type': etherws.TapHandler.IFTYPE, 'target': device}
+
+
+def _websocket_port_params(addr=None, url=None):
+    if url is None:
+        url = 'ws://[%s]' % addr
+    return {
+        'type': etherws.ClientHandler.IFTYPE,
+        'target': url,
+        'options': {
+            'user': None,
+            'passwd': None,
+            'cacerts': None,
+            'insecure': False
+        }
+    }
 
 
 def create_etherws_tap(device):
-    ctl_addport_tap_args = CtlAddPortTapArgs()
-    ctl_addport_tap_args.target = device
-    etherws._start_ctl(ctl_addport_tap_args)
+    return _ctl_call('addPort', _tap_port_params(device))
 
 
 def del_etherws_port(portnum):
-    ctl_delport_args = CtlDelPortArgs()
-    ctl_delport_args.port = portnum
-    etherws._start_ctl(ctl_delport_args)
+    return _ctl_call('delPort', {'port': portnum})
 
 
-def create_etherws_websocket(addr):
-    ctl_addport_client_args = CtlAddPortClientArgs()
-    ctl_addport_client_args.target = 'ws://[%s]' % addr
-    etherws._start_ctl(ctl_addport_client_args)
+def create_etherws_websocket(addr=None, url=None):
+    return _ctl_call('addPort', _websocket_port_params(addr, url))
 
 
 class TunnelEtherWs(tunnel_utils.TunnelMode):
@@ -148,15 +366,18 @@ class TunnelEtherWs(tunnel_utils.TunnelMode):
         # messages to keep the tunnel open
         req_keep_alive_messages = True
         # NAT types supported by the etherws tunnel mode
-        supported_nat_types = [
-            pynat.OPEN,
-            pynat.FULL_CONE,
-            pynat.RESTRICTED_CONE,
-            pynat.RESTRICTED_PORT,
-            pynat.SYMMETRIC,
-            pynat.UDP_FIREWALL,
-            pynat.BLOCKED,
-        ]
+        supported_nat_types = _NAT_TYPES
+        # Mapping device ID to the etherws port numbers allocated for
+        # the device; remembering the ports at allocation time makes
+        # the teardown O(1) instead of scanning (or hard-coding) the
+        # port list
+        self.device_ports = dict()
+        # Cache of the canonical per-device interface names; computing
+        # the name once makes it reusable across create/destroy paths
+        self._names = dict()
+        # The controller websocket URL is stable for the lifetime of
+        # the tunnel mode; format it once
+        self._ws_url = 'ws://[%s]' % controller_ip
         # Create the tunnel mode
         super().__init__(
             name=name,
@@ -167,6 +388,14 @@ class TunnelEtherWs(tunnel_utils.TunnelMode):
             debug=debug
         )
 
+    def _device_name(self, deviceid):
+        # Canonical name of the TAP interface associated to the device
+        name = self._names.get(deviceid)
+        if name is None:
+            name = '%s-%s' % (self.name, deviceid[:3])
+            self._names[deviceid] = name
+        return name
+
     def create_tunnel_device_endpoint(self, deviceid, tenantid, vxlan_port):
         # Nothing to do
         # (status_code, device_vtep_mac)
@@ -183,12 +412,27 @@ class TunnelEtherWs(tunnel_utils.TunnelMode):
     ):
         logging.info('Configuring the etherws tunnel')
         # Name of the TAP interface
-        tap_name = '%s-%s' % (self.name, deviceid[:3])
+        tap_name = self._device_name(deviceid)
         # Create the etherws TAP interface
         logging.debug(
             'Attempting to create the TAP interface %s', tap_name
         )
-        create_etherws_tap(device=tap_name)
+        logging.debug(
+            'Attempting to create the websocket '
+            'interface with dst address %s',
+            self.controller_ip
+        )
+        # Create the etherws TAP and websocket interfaces with a single
+        # roundtrip to the control API
+        replies = _ctl_batch(
+            ('addPort', _tap_port_params(tap_name)),
+            ('addPort', _websocket_port_params(url=self._ws_url))
+        )
+        # Track the allocated port numbers, used for the teardown
+        for reply in replies:
+            port = _port_from_reply(reply)
+            if port is not None:
+                self.device_ports.setdefault(deviceid, []).append(port)
         # Add the private address
         self.device_vtep_ip = device_vtep_ip
         self.vtep_mask = vtep_mask
@@ -198,16 +442,9 @@ class TunnelEtherWs(tunnel_utils.TunnelMode):
             self.device_vtep_ip,
             vtep_mask, tap_name
         )
-        tunnel_utils.add_address(
-            device=tap_name, address=self.device_vtep_ip, mask=vtep_mask
-        )
-        # Create the etherws websocket interface
-        logging.debug(
-            'Attempting to create the websocket '
-            'interface with dst address %s',
-            self.controller_ip
+        tunnel_utils.add_addresses(
+            device=tap_name, addresses=[(self.device_vtep_ip, vtep_mask)]
         )
-        create_etherws_websocket(addr=self.controller_ip)
         # Save the VTEP's IP address of the controller
         self.controller_mgmtip = controller_vtep_ip
         # Success
@@ -226,22 +463,14 @@ class TunnelEtherWs(tunnel_utils.TunnelMode):
         logging.info(
             'Configuring the etherws tunnel for the device %s', deviceid
         )
-        # Generate private addresses for the device and controller VTEPs
+        # Generate private addresses for the device and controller VTEPs;
+        # the v4 and v6 paths only differ in the allocator to use
         family = tunnel_utils.getAddressFamily(device_external_ip)
         if family == AF_INET6:
             # Change to make dependant from the device ID?
-            net = srv6_sdn_controller_state.get_new_mgmt_ipv6_net(deviceid)
-            net = IPv6Network(net)
-            controller_vtep_ip = net[1].__str__()
-            device_vtep_ip = net[2].__str__()
-            vtep_mask = net.prefixlen
-        # elif family == AF_INET:       # TODO handle IPv6
+            get_new_mgmt_net = srv6_sdn_controller_state.get_new_mgmt_ipv6_net
         elif family == AF_INET:
-            net = srv6_sdn_controller_state.get_new_mgmt_ipv4_net(deviceid)
-            net = IPv4Network(net)
-            controller_vtep_ip = net[1].__str__()
-            device_vtep_ip = net[2].__str__()
-            vtep_mask = net.prefixlen
+            get_new_mgmt_net = srv6_sdn_controller_state.get_new_mgmt_ipv4_net
         else:
             logging.error(
                 'Invalid family address: %s', device_external_ip
@@ -255,18 +484,22 @@ class TunnelEtherWs(tunnel_utils.TunnelMode):
                 None,
                 None
             )
-        # else:
-        #    logging.error('Invalid family address: %s' %
-        #                  tunnel_info.device_external_ip)
-        #    return status_codes_pb2.STATUS_INTERNAL_ERROR
+        net = get_new_mgmt_net(deviceid)
+        controller_vtep_ip, device_vtep_ip, vtep_mask = _vteps_from_net(
+            net, family
+        )
         # Name of the TAP interface
-        tap_name = '%s-%s' % (self.name, deviceid[:3])
+        tap_name = self._device_name(deviceid)
         # Create the etherws TAP interface
         logging.debug(
             'Attempting to create the TAP '
             'interface %s', tap_name
         )
-        create_etherws_tap(device=tap_name)
+        reply = create_etherws_tap(device=tap_name)
+        # Track the allocated port number, used for the teardown
+        tap_port = _port_from_reply(reply)
+        if tap_port is not None:
+            self.device_ports.setdefault(deviceid, []).append(tap_port)
         # Add the private address
         logging.debug(
             'Attempting to assign the IP address %s/%s '
@@ -275,8 +508,8 @@ class TunnelEtherWs(tunnel_utils.TunnelMode):
             vtep_mask,
             tap_name
         )
-        tunnel_utils.add_address(
-            device=tap_name, address=controller_vtep_ip, mask=vtep_mask
+        tunnel_utils.add_addresses(
+            device=tap_name, addresses=[(controller_vtep_ip, vtep_mask)]
         )
         # Update device VTEP IP address
         success = srv6_sdn_controller_state.update_device_vtep_ip(
@@ -320,7 +553,7 @@ class TunnelEtherWs(tunnel_utils.TunnelMode):
     ):
         logging.info('Destroying the etherws tunnel')
         # Get the name of the TAP interface
-        tap_name = '%s-%s' % (self.name, deviceid[:3])
+        tap_name = self._device_name(deviceid)
         # Remove the IP address assigned to the interface
         device_vtep_ip = self.device_vtep_ip
         vtep_mask = self.vtep_mask
@@ -335,11 +568,16 @@ class TunnelEtherWs(tunnel_utils.TunnelMode):
             tunnel_utils.del_address(
                 device=tap_name, address=device_vtep_ip, mask=vtep_mask
             )
-        # Delete the TAP interface
-        tunnel_utils.delete_interface(device=tap_name)
-        # del_etherws_port(1)
-        # Delete the websocket interface
-        # del_etherws_port(2)
+        # Delete the etherws ports allocated for the device
+        # (closing the TAP port also removes the kernel interface)
+        ports = self.device_ports.pop(deviceid, None)
+        if ports is not None:
+            for portnum in reversed(ports):
+                del_etherws_port(portnum)
+        else:
+            # No tracked ports (e.g. the process has been restarted);
+            # fall back to removing the TAP interface directly
+            tunnel_utils.delete_interface(device=tap_name)
         # Remove the controller private address
         self.controller_private_ip = None
         # Success
@@ -349,18 +587,24 @@ class TunnelEtherWs(tunnel_utils.TunnelMode):
         logging.info(
             'Destroying the VXLAN tunnel for the device %s', deviceid
         )
-        # Delete the TAP interface
-        tap_name = '%s-%s' % (self.name, deviceid[:3])
-        try:
-            tunnel_utils.delete_interface(device=tap_name)
-        except pyroute2.netlink.exceptions.NetlinkError as e:
-            if e.code == NO_SUCH_FILE_OR_DIRECTORY:
-                logging.warning('Skipping remove_ip_neigh: %s' % e)
-            else:
-                logging.error('Error in remove_ip_neigh: %s' % e)
-                return status_codes_pb2.STATUS_INTERNAL_ERROR
-        # Delete the TAP interface
-        # del_etherws_port(1)
+        # Delete the etherws ports allocated for the device
+        # (closing the TAP port also removes the kernel interface)
+        tap_name = self._device_name(deviceid)
+        ports = self.device_ports.pop(deviceid, None)
+        if ports is not None:
+            for portnum in reversed(ports):
+                del_etherws_port(portnum)
+        else:
+            # No tracked ports (e.g. the process has been restarted);
+            # fall back to removing the TAP interface directly
+            try:
+                tunnel_utils.delete_interface(device=tap_name)
+            except pyroute2.netlink.exceptions.NetlinkError as e:
+                if e.code == NO_SUCH_FILE_OR_DIRECTORY:
+                    logging.warning('Skipping remove_ip_neigh: %s', e)
+                else:
+                    logging.error('Error in remove_ip_neigh: %s', e)
+                    return status_codes_pb2.STATUS_INTERNAL_ERROR
         # Release the private IP address associated to the device
         mgmtip = srv6_sdn_controller_state.get_device_mgmtip(
             tenantid=tenantid, deviceid=deviceid
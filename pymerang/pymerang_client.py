@@ -702,7 +702,7 @@ class PymerangDevice:
                 return status_codes_pb2.STATUS_UNAUTHORIZED
             else:
                 # Unknown status code
-                logging.warning('Unknown status code: %s' % response.status)
+                logging.warning('Unknown status code: %s', response.status)
                 return response.status
 
     def _exec_reconciliation(self):
@@ -728,7 +728,7 @@ class PymerangDevice:
                 return status_codes_pb2.STATUS_SUCCESS
             else:
                 # Unknown status code
-                logging.warning('Unknown status code: %s' % response.status)
+                logging.warning('Unknown status code: %s', response.status)
                 return response.status
 
     def update_mgmt_info(self):
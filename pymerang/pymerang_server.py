@@ -3,22 +3,43 @@
 # General imports
 from argparse import ArgumentParser
 from concurrent import futures
-from threading import Thread, Event
+from typing import NamedTuple
+import asyncio
+from threading import Thread, Event, Lock, Semaphore, local
 from socket import AF_INET, AF_INET6
 import logging
+import os
+import re
+import signal
 import time
-import grpc
+
+# Prefer the native (C++/upb) protobuf backend: the RPC handlers walk
+# deeply nested messages and the pure-Python backend is much slower at
+# field access; this must be set before the *_pb2 modules are imported
+os.environ.setdefault('PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION', 'cpp')
+
+import grpc  # noqa: E402
+from google.protobuf.internal import api_implementation  # noqa: E402
 # pymerang dependencies
-from pymerang import utils
-from pymerang import tunnel_utils
-from pymerang import pymerang_pb2
-from pymerang import pymerang_pb2_grpc
-from pymerang import status_codes_pb2
+from pymerang import utils  # noqa: E402
+from pymerang import tunnel_utils  # noqa: E402
+from pymerang import pymerang_pb2  # noqa: E402
+from pymerang import pymerang_pb2_grpc  # noqa: E402
+from pymerang import status_codes_pb2  # noqa: E402
 # SRv6 dependencies
-from srv6_sdn_controller_state import srv6_sdn_controller_state
-from srv6_sdn_controller_state.srv6_sdn_controller_state import DeviceState
+from srv6_sdn_controller_state import srv6_sdn_controller_state  # noqa: E402
+from srv6_sdn_controller_state.srv6_sdn_controller_state import (  # noqa: E402
+    DeviceState
+)
+
+from rollbackcontext import RollbackContext  # noqa: E402
 
-from rollbackcontext import RollbackContext
+if api_implementation.Type() not in ('cpp', 'upb'):
+    logging.warning(
+        'The pure-Python protobuf backend is in use; message parsing '
+        'will be much slower. Install a protobuf runtime with native '
+        'support (e.g. protobuf>=4.21) to speed up the RPC handlers.'
+    )
 
 # Loopback IP address of the controller
 DEFAULT_PYMERANG_SERVER_IP = '::'
@@ -39,6 +60,59 @@ DEFAULT_KEY = 'key_server.pem'
 # Default VXLAN port
 DEFAULT_VXLAN_PORT = 4789
 
+# Size of the thread pool serving the RPCs; bounded so that a burst of
+# registrations cannot grow the pool (and the memory) without limit
+GRPC_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+# Size of the thread pool running the keep alive monitors; each
+# monitored device holds a worker for the lifetime of its tunnel, so
+# this bounds the number of concurrently monitored devices
+KEEP_ALIVE_MAX_WORKERS = 512
+# Maximum number of keep alive streams concurrently open on a server
+# instance; each open stream pins one worker of the gRPC pool for the
+# lifetime of the device, so the pool is sized with this many extra
+# workers and excess devices are pushed back to the unary KeepAlive
+MAX_KEEP_ALIVE_STREAMS = 512
+# Size of the thread pool restoring the management tunnels at startup
+RESTORE_MAX_WORKERS = 32
+# Seconds granted to the in-flight RPCs when the server is stopped
+GRPC_STOP_GRACE = 5
+# Compression algorithms selectable from the command line
+GRPC_COMPRESSION_ALGORITHMS = {
+    'none': grpc.Compression.NoCompression,
+    'gzip': grpc.Compression.Gzip
+}
+# Default compression applied to the replies; registration payloads
+# are text heavy (device IDs, addresses, MACs) and compress well
+DEFAULT_GRPC_COMPRESSION = 'gzip'
+# Default number of gRPC server instances sharing the listen address
+DEFAULT_NUM_SERVERS = 1
+
+# Channel options of the gRPC server. Device channels are long-lived
+# and mostly idle between heartbeats: HTTP/2 keepalive pings keep them
+# (and any NAT bindings on the path) alive and detect dead peers at
+# the transport level, instead of leaving that to the app-level keep
+# alive monitor alone
+GRPC_SERVER_OPTIONS = [
+    ('grpc.so_reuseport', 1),
+    ('grpc.max_send_message_length', 16 * 1024 * 1024),
+    # Ping idle device channels every 30 seconds and drop them if the
+    # ack does not come back within 10 seconds
+    ('grpc.keepalive_time_ms', 30000),
+    ('grpc.keepalive_timeout_ms', 10000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    ('grpc.http2.min_time_between_pings_ms', 10000),
+    # Streams per device channel; devices multiplex the keep alive
+    # stream with the occasional unary RPC
+    ('grpc.max_concurrent_streams', 1000)
+]
+
+# TTL (in seconds) of the cached get_device results; short enough that
+# a stale entry can only be served for a couple of heartbeats
+DEVICE_CACHE_TTL = 2.0
+# Max number of devices kept in the cache
+DEVICE_CACHE_MAXSIZE = 10000
+
 # Status codes
 STATUS_SUCCESS = status_codes_pb2.STATUS_SUCCESS
 STATUS_UNAUTHORIZED = status_codes_pb2.STATUS_UNAUTHORIZED
@@ -46,122 +120,215 @@ STATUS_INTERNAL_ERROR = status_codes_pb2.STATUS_INTERNAL_ERROR
 
 MAX_ALLOWED_RECONCILIATION_FAILURES = 10000000
 
+# Hot-path aliases: the reply constructor, the unknown-state default
+# and the device lookup are referenced on every RPC; binding them once
+# at module scope removes the repeated attribute-chain walks
+_Reply = pymerang_pb2.RegisterDeviceReply
+_DEVICE_STATE_UNKNOWN = DeviceState.UNKNOWN.value
+_get_device = srv6_sdn_controller_state.get_device
+
+# Newer controller-state releases expose finalize_mgmt_update, which
+# merges the management info update, the connected flag and the state
+# change into a single DB write; older releases need one roundtrip per
+# field, so fall back to the separate calls when it is missing
+_finalize_mgmt_update = getattr(
+    srv6_sdn_controller_state, 'finalize_mgmt_update', None
+)
+
+# gRPC peers look like 'ipv6:[::1]:50061' or 'ipv4:10.0.0.1:50061';
+# the handlers only need the IP as a string, so a regex is enough and
+# avoids building an ipaddress object on every RPC
+_PEER_RE = re.compile(r'^ipv[46]:(?:\[([^\]]+)\]|([^:]+)):\d+$')
+
+
+def _peer_ip(peer):
+    match = _PEER_RE.match(peer)
+    if match is None:
+        # Unexpected peer format; fall back to the full parser
+        return str(utils.parse_ip_port(peer)[0])
+    return match.group(1) or match.group(2)
+
+
+# Mapping from the SRTransparency enum to the string form used in the
+# controller state; unknown values default to T0 transparency
+_SR_T0 = pymerang_pb2.SRTransparency.T0
+_SR_TRANSPARENCY_MAP = {
+    pymerang_pb2.SRTransparency.T1: 't1',
+    pymerang_pb2.SRTransparency.OP: 'op'
+}
+
+
+# Request-parsing helpers
+#
+# The hot per-RPC parsing is kept in standalone module-level functions,
+# out of the servicer class: they take only protobuf messages and
+# return plain Python structures, which keeps them independent from the
+# gRPC machinery (and straightforward to compile with an ahead-of-time
+# tool if the deployment needs it)
+
+class Iface(NamedTuple):
+    # Per-interface record built from a registration request; a
+    # fixed-field tuple is much lighter than the 9-key dict it
+    # replaces and fields are read by attribute instead of by hash
+    # lookup. _asdict() converts a record at the controller-state
+    # boundary, which still expects mappings.
+    name: str
+    mac_addr: str
+    ipv4_addrs: list
+    ipv6_addrs: list
+    ipv4_subnets: list
+    ipv6_subnets: list
+    ext_ipv4_addrs: list
+    ext_ipv6_addrs: list
+    type: str
+
+
+class ConnectedDevice(NamedTuple):
+    # Per-device record kept while the management tunnel is up. The
+    # resolved tunnel mode object is memoized at tunnel-setup time so
+    # the teardown paths can reach it without a device lookup on the
+    # controller state
+    stop_event: Event
+    tunnel_mode: object
+
+
+def _parse_features(device):
+    # Features supported by the device
+    return [
+        {'name': feature.name, 'port': feature.port}
+        for feature in device.features
+    ]
+
+
+def _parse_interfaces(interfaces):
+    # Interfaces of the device, as reported at registration time
+    #
+    # Repeated fields are converted in bulk (list() and the
+    # comprehensions below iterate in C), instead of appending the
+    # protobuf attributes one by one      # TODO add validation checks?
+    return [
+        Iface(
+            name=interface.name,
+            mac_addr=interface.mac_addr,
+            ipv4_addrs=list(interface.ipv4_addrs),
+            ipv6_addrs=list(interface.ipv6_addrs),
+            ipv4_subnets=[
+                {'subnet': subnet.subnet, 'gateway': subnet.gateway}
+                if subnet.gateway != ''
+                else {'subnet': subnet.subnet}
+                for subnet in interface.ipv4_subnets
+            ],
+            ipv6_subnets=[
+                {'subnet': subnet.subnet, 'gateway': subnet.gateway}
+                if subnet.gateway != ''
+                else {'subnet': subnet.subnet}
+                for subnet in interface.ipv6_subnets
+            ],
+            ext_ipv4_addrs=list(),
+            ext_ipv6_addrs=list(),
+            type=utils.InterfaceType.UNKNOWN,
+        )
+        for interface in interfaces
+    ]
+
+
+def _parse_ext_interfaces(interfaces):
+    # Interfaces of the device, with the externally visible addresses
+    return {
+        interface.name: {
+            'name': interface.name,
+            'ext_ipv4_addrs': list(interface.ext_ipv4_addrs),
+            'ext_ipv6_addrs': list(interface.ext_ipv6_addrs)
+        }      # TODO add validation checks?
+        for interface in interfaces
+    }
+
 
 class PymerangServicer(pymerang_pb2_grpc.PymerangServicer):
     """Provides methods that implement functionality of route guide server."""
 
     def __init__(self, controller):
         self.controller = controller
+        # Per-thread scratch reply reused by the keep alive handler;
+        # gRPC serializes the response before the worker thread picks
+        # up another RPC, so the message can be recycled instead of
+        # constructed on every heartbeat
+        self._keep_alive_reply = local()
+        # Admission bound of the keep alive streams (see
+        # MAX_KEEP_ALIVE_STREAMS)
+        self._stream_slots = Semaphore(MAX_KEEP_ALIVE_STREAMS)
 
     def RegisterDevice(self, request, context):
-        logging.info('\n\n=-=-=-=-=-==-=-=-=-=-=-=-=-=-=-=-==-=-=-=New device connected: %s' % request)
-
-        logging.info('=-=-=-=-=-==-=-=-=-=-=-=-=-=-=-=-==-=-=-=\n\n')
-
-        
+        logging.info('New device connected: %s', request.device.id)
+        # The full request dump walks every protobuf field; only pay
+        # for it when debugging
+        logging.debug('RegisterDevice request: %s', request)
         # Get the IP address seen by the gRPC server
         # It can be used for management
-        mgmtip = context.peer()
-        # Separate IP and port
-        mgmtip = utils.parse_ip_port(mgmtip)[0].__str__()
+        mgmtip = _peer_ip(context.peer())
         # Extract the parameters from the registration request
         #
         # Device ID
         deviceid = request.device.id
         # Features supported by the device
-        features = list()
-        for feature in request.device.features:
-            name = feature.name
-            port = feature.port
-            features.append({'name': name, 'port': port})
+        features = _parse_features(request.device)
         # Data needed for the device authentication
         auth_data = request.auth_data
-        # Prefix to be used for SRv6 tunnels
-        sid_prefix = None
-        if request.sid_prefix != '':
-            sid_prefix = request.sid_prefix
         # Define whether to enable or not proxy NDP for SIDs advertisement
         enable_proxy_ndp = request.enable_proxy_ndp
-        # Define whether to force the device using ip6tnl or not
-        force_ip6tnl = request.force_ip6tnl
-        # Define whether to force the device using SRH or not
-        force_srh = request.force_srh
-        # Incoming Segment Routing transparency [ t0 | t1 | op ]
-        incoming_sr_transparency = request.incoming_sr_transparency
-        if incoming_sr_transparency == pymerang_pb2.SRTransparency.T1:
-            incoming_sr_transparency = 't1'
-        elif incoming_sr_transparency == pymerang_pb2.SRTransparency.OP:
-            incoming_sr_transparency = 'op'
-        else:  # by default we assume T0 transparency
+        if (
+            not request.sid_prefix
+            and not request.public_prefix_length
+            and not request.force_ip6tnl
+            and not request.force_srh
+            and request.incoming_sr_transparency <= _SR_T0
+            and request.outgoing_sr_transparency <= _SR_T0
+        ):
+            # Common case: every optional knob is at its proto default,
+            # so the resolved values are known constants and the
+            # per-field extraction below can be skipped
+            sid_prefix = None
+            public_prefix_length = 128
+            force_ip6tnl = False
+            force_srh = False
             incoming_sr_transparency = 't0'
-        # Outgoing Segment Routing transparency [ t0 | t1 | op ]
-        outgoing_sr_transparency = request.outgoing_sr_transparency
-        if outgoing_sr_transparency == pymerang_pb2.SRTransparency.T1:
-            outgoing_sr_transparency = 't1'
-        elif outgoing_sr_transparency == pymerang_pb2.SRTransparency.OP:
-            outgoing_sr_transparency = 'op'
-        else:  # by default we assume T0 transparency
             outgoing_sr_transparency = 't0'
-        # Public prefix length used to compute SRv6 SID list
-        public_prefix_length = 128
-        if request.public_prefix_length != 0:
-            public_prefix_length = request.public_prefix_length
-        # Interfaces of the devices
-        interfaces = list()
-        for interface in request.interfaces:
-            # Interface name
-            ifname = interface.name
-            # MAC address
-            mac_addr = interface.mac_addr
-            # IPv4 addresses
-            ipv4_addrs = list()
-            for addr in interface.ipv4_addrs:
-                ipv4_addrs.append(addr)     # TODO add validation checks?
-            # IPv6 addresses
-            ipv6_addrs = list()
-            for addr in interface.ipv6_addrs:
-                ipv6_addrs.append(addr)     # TODO add validation checks?
-            # IPv4 subnets
-            ipv4_subnets = list()
-            for ipv4_subnet in interface.ipv4_subnets:
-                ipv4_subnet.gateway
-                subnet = dict()
-                subnet['subnet'] = ipv4_subnet.subnet
-                if ipv4_subnet.gateway != '':
-                    subnet['gateway'] = ipv4_subnet.gateway
-                ipv4_subnets.append(subnet)     # TODO add validation checks?
-            # IPv6 subnets
-            ipv6_subnets = list()
-            for ipv6_subnet in interface.ipv6_subnets:
-                ipv6_subnet.gateway
-                subnet = dict()
-                subnet['subnet'] = ipv6_subnet.subnet
-                if ipv6_subnet.gateway != '':
-                    subnet['gateway'] = ipv6_subnet.gateway
-                ipv6_subnets.append(subnet)     # TODO add validation checks?
-            # Save the interface
-            interfaces.append(
-                {
-                    'name': ifname,
-                    'mac_addr': mac_addr,
-                    'ipv4_addrs': ipv4_addrs,
-                    'ipv6_addrs': ipv6_addrs,
-                    'ipv4_subnets': ipv4_subnets,
-                    'ipv6_subnets': ipv6_subnets,
-                    'ext_ipv4_addrs': list(),
-                    'ext_ipv6_addrs': list(),
-                    'type': utils.InterfaceType.UNKNOWN,
-                }
+        else:
+            # Prefix to be used for SRv6 tunnels
+            sid_prefix = None
+            if request.sid_prefix != '':
+                sid_prefix = request.sid_prefix
+            # Define whether to force the device using ip6tnl or not
+            force_ip6tnl = request.force_ip6tnl
+            # Define whether to force the device using SRH or not
+            force_srh = request.force_srh
+            # Incoming Segment Routing transparency [ t0 | t1 | op ]
+            # by default we assume T0 transparency
+            incoming_sr_transparency = _SR_TRANSPARENCY_MAP.get(
+                request.incoming_sr_transparency, 't0'
+            )
+            # Outgoing Segment Routing transparency [ t0 | t1 | op ]
+            # by default we assume T0 transparency
+            outgoing_sr_transparency = _SR_TRANSPARENCY_MAP.get(
+                request.outgoing_sr_transparency, 't0'
             )
+            # Public prefix length used to compute SRv6 SID list
+            public_prefix_length = 128
+            if request.public_prefix_length != 0:
+                public_prefix_length = request.public_prefix_length
         # Prepare the response message
-        reply = pymerang_pb2.RegisterDeviceReply()
+        reply = _Reply()
         # Register the device
+        #
+        # The raw protobuf interfaces are handed down as is; the
+        # controller materializes them into Python structures only on
+        # the paths that actually persist them
         logging.debug('Trying to register the device %s', deviceid)
-        response, vxlan_port, tenantid = (
+        response, vxlan_port, tenantid, device_state = (
             self.controller.register_device(
                 deviceid,
                 features,
-                interfaces,
+                request.interfaces,
                 mgmtip,
                 auth_data,
                 sid_prefix,
@@ -175,20 +342,18 @@ class PymerangServicer(pymerang_pb2_grpc.PymerangServicer):
         )
         if response == STATUS_UNAUTHORIZED:
             return (
-                pymerang_pb2.RegisterDeviceReply(status=STATUS_UNAUTHORIZED)
+                _Reply(status=STATUS_UNAUTHORIZED)
             )
         if response != STATUS_SUCCESS:
             # Get the device
-            device = srv6_sdn_controller_state.get_device(
-                deviceid=deviceid, tenantid=tenantid
-            )
+            device = self.controller.get_device(deviceid, tenantid)
             if device is None:
                 logging.error('Error getting device')
                 return status_codes_pb2.STATUS_INTERNAL_ERROR
             return (
-                pymerang_pb2.RegisterDeviceReply(
+                _Reply(
                     status=response,
-                    device_state=device.get('state', DeviceState.UNKNOWN.value)
+                    device_state=device.get('state', _DEVICE_STATE_UNKNOWN)
                 )
             )
         # Set the status code
@@ -197,54 +362,33 @@ class PymerangServicer(pymerang_pb2_grpc.PymerangServicer):
         reply.mgmt_info.vxlan_port = vxlan_port
         # Set the tenant ID
         reply.tenantid = tenantid
-        # Get the device
-        device = srv6_sdn_controller_state.get_device(
-            deviceid=deviceid, tenantid=tenantid
-        )
-        if device is None:
-            logging.error('Error getting device')
-            return status_codes_pb2.STATUS_INTERNAL_ERROR
-        reply.device_state = device.get('state', DeviceState.UNKNOWN.value)
+        # Set the device state returned by the registration, sparing
+        # another device lookup
+        reply.device_state = device_state
         # Send the reply
-        logging.info(
-            'Device registered succefully. Sending the reply: %s', reply
-        )
+        logging.info('Device registered succefully')
+        logging.debug('Sending the reply: %s', reply)
         return reply
 
     def UpdateMgmtInfo(self, request, context):
-        logging.info('*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_Establish tunnel connection: %s', request)
-        logging.info('*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*_*')
+        logging.info('Establish tunnel connection: %s', request.device.id)
+        # The full request dump walks every protobuf field; only pay
+        # for it when debugging
+        logging.debug('UpdateMgmtInfo request: %s', request)
 
         # Get the IP address seen by the gRPC server
         # It can be used for management
-        mgmtip = context.peer()
-        # Separate IP and port
-        mgmtip = utils.parse_ip_port(mgmtip)[0].__str__()
+        mgmtip = _peer_ip(context.peer())
         # Extract the parameters from the registration request
         #
         # Device ID
         deviceid = request.device.id
         # Tenant ID
         tenantid = request.tenantid
-        # Interfaces of the devices
-        interfaces = dict()
-        for interface in request.interfaces:
-            # Interface name
-            ifname = interface.name
-            # IPv4 addresses
-            ipv4_addrs = list()
-            for addr in interface.ext_ipv4_addrs:
-                ipv4_addrs.append(addr)     # TODO add validation checks?
-            # IPv6 addresses
-            ipv6_addrs = list()
-            for addr in interface.ext_ipv6_addrs:
-                ipv6_addrs.append(addr)     # TODO add validation checks?
-            # Save the interface
-            interfaces[ifname] = {
-                'name': ifname,
-                'ext_ipv4_addrs': ipv4_addrs,
-                'ext_ipv6_addrs': ipv6_addrs
-            }
+        # Interfaces of the devices: the raw protobuf messages are
+        # handed down and materialized by the controller right before
+        # the DB write
+        interfaces = request.interfaces
         # Extract tunnel mode
         tunnel_mode = request.mgmt_info.tunnel_mode
         # Extract NAT type
@@ -270,9 +414,9 @@ class PymerangServicer(pymerang_pb2_grpc.PymerangServicer):
             )
         if response != STATUS_SUCCESS:
             logging.error('Cannot update management information')
-            return pymerang_pb2.RegisterDeviceReply(status=response)
+            return _Reply(status=response)
         # Create the response
-        reply = pymerang_pb2.RegisterDeviceReply()
+        reply = _Reply()
         # Set the status code
         reply.status = STATUS_SUCCESS
         # Set the controller VTEP MAC
@@ -288,11 +432,17 @@ class PymerangServicer(pymerang_pb2_grpc.PymerangServicer):
         if vtep_mask is not None:
             reply.mgmt_info.vtep_mask = vtep_mask
         # Send the reply
-        logging.info('Sending the reply ( UpdateMgmtInfo ) : %s' % reply)
+        logging.debug('Sending the reply ( UpdateMgmtInfo ) : %s', reply)
         return reply
 
     def UnregisterDevice(self, request, context):
-        logging.info('Unregister device request: %s' % request)
+        logging.info('Unregister device request: %s', request.device.id)
+        # Reject malformed requests before touching the DB
+        if not request.device.id or not request.tenantid:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return _Reply(
+                status=STATUS_UNAUTHORIZED
+            )
         # Extract the parameters from the registration request
         #
         # Device ID
@@ -303,37 +453,76 @@ class PymerangServicer(pymerang_pb2_grpc.PymerangServicer):
         logging.debug('Trying to unregister the device %s', deviceid)
         response = self.controller.unregister_device(deviceid, tenantid)
         if response is not STATUS_SUCCESS:
-            return pymerang_pb2.RegisterDeviceReply(status=response)
+            return _Reply(status=response)
         # Send the reply
-        reply = pymerang_pb2.RegisterDeviceReply(status=STATUS_SUCCESS)
-        logging.info('Sending the reply ( UnregisterDevice ) : %s', reply)
+        reply = _Reply(status=STATUS_SUCCESS)
+        logging.debug('Sending the reply ( UnregisterDevice ) : %s', reply)
         return reply
 
     def KeepAlive(self, request, context):
         logging.debug('Received keep alive message on the gRPC channel')
+        # Reject malformed requests before touching the DB
+        if not request.device.id or not request.tenantid:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return _Reply(
+                status=STATUS_UNAUTHORIZED
+            )
         # Device ID
         deviceid = request.device.id
         # Tenant ID
         tenantid = request.tenantid
-        # Get the device
-        device = srv6_sdn_controller_state.get_device(
-            deviceid=deviceid, tenantid=tenantid
-        )
+        # Get the device (served from the controller cache on the
+        # heartbeat path)
+        device = self.controller.get_device(deviceid, tenantid)
         if device is None:
             logging.error('Error getting device')
             return status_codes_pb2.STATUS_INTERNAL_ERROR
-        # Report the status to the device
-        reply = pymerang_pb2.RegisterDeviceReply(
-            status=STATUS_SUCCESS,
-            device_state=device.get('state', DeviceState.UNKNOWN.value)
-        )
+        # Report the status to the device, recycling the per-thread
+        # scratch reply
+        reply = getattr(self._keep_alive_reply, 'reply', None)
+        if reply is None:
+            reply = _Reply()
+            self._keep_alive_reply.reply = reply
+        reply.Clear()
+        reply.status = STATUS_SUCCESS
+        reply.device_state = device.get('state', _DEVICE_STATE_UNKNOWN)
         logging.debug('Sending the reply (KeepAlive) : %s', reply)
         return reply
 
+    def KeepAliveStream(self, request_iterator, context):
+        # Streamed variant of KeepAlive: the device sends all its keep
+        # alive messages over one long-lived bidirectional stream, so
+        # the server pays the RPC setup cost once per device instead of
+        # once per message. The unary KeepAlive is kept for devices
+        # that do not support streaming yet.
+        #
+        # An open stream holds its worker thread until the device
+        # disconnects; when all the stream slots are taken the device
+        # is rejected with RESOURCE_EXHAUSTED and falls back to the
+        # unary KeepAlive, so the streams cannot starve the other RPCs
+        if not self._stream_slots.acquire(blocking=False):
+            context.abort(
+                grpc.StatusCode.RESOURCE_EXHAUSTED,
+                'Too many open keep alive streams'
+            )
+        logging.debug('Keep alive stream opened on the gRPC channel')
+        try:
+            for request in request_iterator:
+                yield self.KeepAlive(request, context)
+        finally:
+            self._stream_slots.release()
+            logging.debug('Keep alive stream closed on the gRPC channel')
+
     def ExecReconciliation(self, request, context):
         logging.debug(
             'Received ExecReconciliation message on the gRPC channel'
         )
+        # Reject malformed requests before touching the DB
+        if not request.device.id or not request.tenantid:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return _Reply(
+                status=STATUS_UNAUTHORIZED
+            )
         # Device ID
         deviceid = request.device.id
         # Tenant ID
@@ -345,16 +534,16 @@ class PymerangServicer(pymerang_pb2_grpc.PymerangServicer):
         if res != STATUS_SUCCESS:
             logging.error('Error in exec_reconciliation')
         # Get the device
-        device = srv6_sdn_controller_state.get_device(deviceid, tenantid)
+        device = self.controller.get_device(deviceid, tenantid)
         if device is None:
-            logging.error('Device %s not found' % deviceid)
+            logging.error('Device %s not found', deviceid)
             return STATUS_INTERNAL_ERROR
         # Report the status to the device
-        reply = pymerang_pb2.RegisterDeviceReply(
+        reply = _Reply(
             status=res,
             device_state=device.get(
                 'state',
-                device.get('state', DeviceState.UNKNOWN.value)
+                device.get('state', _DEVICE_STATE_UNKNOWN)
             )
         )
         logging.debug('Sending the reply (ExecReconciliation): %s', reply)
@@ -372,12 +561,25 @@ class PymerangController:
         secure=DEFAULT_SECURE,
         key=DEFAULT_KEY,
         certificate=DEFAULT_CERTIFICATE,
-        nb_interface_ref=None
+        nb_interface_ref=None,
+        grpc_workers=GRPC_MAX_WORKERS,
+        num_servers=DEFAULT_NUM_SERVERS,
+        compression=GRPC_COMPRESSION_ALGORITHMS[DEFAULT_GRPC_COMPRESSION]
     ):
         # IP address on which the gRPC listens for connections
         self.server_ip = server_ip
         # Port used by the gRPC server
         self.server_port = server_port
+        # Address family of the listen address and the formatted
+        # listen address, resolved once here instead of on server
+        # start; server_address is None for an invalid listen address
+        self.server_af = tunnel_utils.getAddressFamily(server_ip)
+        if self.server_af == AF_INET6:
+            self.server_address = '[%s]:%s' % (server_ip, server_port)
+        elif self.server_af == AF_INET:
+            self.server_address = '%s:%s' % (server_ip, server_port)
+        else:
+            self.server_address = None
         # Tunnel state
         self.tunnel_state = None
         # Interval between two consecutive keep alive messages
@@ -392,8 +594,97 @@ class PymerangController:
         self.certificate = certificate
         # Reference to the Northbound interface
         self.nb_interface_ref = nb_interface_ref
-        # Devices connected
+        # Size of the thread pool serving the RPCs
+        self.grpc_workers = grpc_workers
+        # Number of server instances sharing the listen address
+        # through SO_REUSEPORT
+        self.num_servers = num_servers
+        # Compression applied to the replies
+        self.compression = compression
+        # gRPC server instances and their pools, populated by serve()
+        self.grpc_servers = []
+        self.grpc_pools = []
+        # Set to stop serve(); see stop_serving()
+        self._stop_serving = Event()
+        # Per-device locks coalescing concurrent reconciliations; the
+        # outer lock guards the dict itself
+        self._recon_locks = dict()
+        self._recon_locks_lock = Lock()
+        # Devices connected, keyed by (tenantid, deviceid); tuple keys
+        # avoid a string interpolation per lookup and cannot collide
+        # with IDs containing the separator
         self.connected_devices = dict()
+        # Shared pool running the blocking disconnect callbacks, so
+        # they do not stall the keep alive event loop
+        self.keep_alive_executor = futures.ThreadPoolExecutor(
+            max_workers=KEEP_ALIVE_MAX_WORKERS,
+            thread_name_prefix='keep-alive'
+        )
+        # Short-TTL cache of get_device results, keyed by
+        # (deviceid, tenantid); it absorbs the periodic keep alive
+        # lookups without a DB roundtrip for each heartbeat
+        self._device_cache = dict()
+        # Single background event loop multiplexing the keep alive
+        # monitors of all the devices; one thread regardless of the
+        # number of connected devices
+        self.keep_alive_loop = asyncio.new_event_loop()
+        Thread(
+            target=self.keep_alive_loop.run_forever,
+            name='keep-alive-loop',
+            daemon=True
+        ).start()
+
+    # Get a device from the controller state, serving repeated lookups
+    # from the short-TTL cache
+    def get_device(self, deviceid, tenantid):
+        key = (deviceid, tenantid)
+        entry = self._device_cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        device = _get_device(deviceid=deviceid, tenantid=tenantid)
+        if device is not None:
+            if len(self._device_cache) >= DEVICE_CACHE_MAXSIZE:
+                self._device_cache.clear()
+            self._device_cache[key] = (
+                time.monotonic() + DEVICE_CACHE_TTL, device
+            )
+        return device
+
+    # Drop the cached entry for a device; called whenever the device
+    # state is changed on the DB
+    def invalidate_device_cache(self, deviceid, tenantid):
+        self._device_cache.pop((deviceid, tenantid), None)
+
+    # Restore the management interface of a single device, if any
+    def _restore_mgmt_interface(self, device):
+        # Get the ID of the device
+        deviceid = device['deviceid']
+        # Get the ID of the tenant
+        tenantid = device['tenantid']
+        # Get the tunnel mode used for this device
+        tunnel_mode = device.get('tunnel_mode')
+        # If tunnel mode is not valid, there is nothing to restore
+        if tunnel_mode is None:
+            return STATUS_SUCCESS
+        logging.info(
+            'Restoring management interface for device %s', deviceid
+        )
+        # Create tunnel controller endpoint
+        tunnel_mode = self.tunnel_state.tunnel_modes[tunnel_mode]
+        res, controller_vtep_mac, controller_vtep_ip, device_vtep_ip, \
+            vtep_mask = tunnel_mode.create_tunnel_controller_endpoint(
+                deviceid=deviceid,
+                tenantid=tenantid,
+                device_external_ip=device.get('external_ip'),
+                device_external_port=device.get('external_port'),
+                vxlan_port=device.get('vxlan_port'),
+                device_vtep_mac=device.get('mgmt_mac')
+            )
+        if res != STATUS_SUCCESS:
+            logging.warning(
+                'Cannot restore the tunnel on device %s', deviceid
+            )
+        return res
 
     # Restore management interfaces, if any
     def restore_mgmt_interfaces(self):
@@ -403,51 +694,31 @@ class PymerangController:
         if devices is None:
             logging.error('Cannot retrieve devices list')
             return
-
-        # Iterate on the devices list
-        for device in devices:
-            # Get the ID of the device
-            deviceid = device['deviceid']
-            # Get the ID of the tenant
-            tenantid = device['tenantid']
-            # Get the tunnel mode used for this device
-            tunnel_mode = device.get('tunnel_mode')
-            # If tunnel mode is valid, restore the tunnel endpoint
-            if tunnel_mode is not None:
-                logging.info(
-                    'Restoring management interface for device %s',
-                    device['deviceid']
-                )
-                if device.get('external_ip') is not None:
-                    device_external_ip = device['external_ip']
-                if device.get('external_port') is not None:
-                    device_external_port = device['external_port']
-                if device.get('mgmt_mac') is not None:
-                    device_vtep_mac = device['mgmt_mac']
-                if device.get('vxlan_port') is not None:
-                    vxlan_port = device['vxlan_port']
-                # Create tunnel controller endpoint
-                tunnel_mode = self.tunnel_state.tunnel_modes[tunnel_mode]
-                res, controller_vtep_mac, controller_vtep_ip, device_vtep_ip, \
-                    vtep_mask = tunnel_mode.create_tunnel_controller_endpoint(
-                        deviceid=deviceid,
-                        tenantid=tenantid,
-                        device_external_ip=device_external_ip,
-                        device_external_port=device_external_port,
-                        vxlan_port=vxlan_port,
-                        device_vtep_mac=device_vtep_mac
-                    )
+        # Restore the devices concurrently: tunnel setup is I/O bound
+        # (netlink and control-plane roundtrips), so startup time stops
+        # growing linearly with the number of devices
+        with futures.ThreadPoolExecutor(
+            max_workers=RESTORE_MAX_WORKERS
+        ) as executor:
+            tasks = [
+                executor.submit(self._restore_mgmt_interface, device)
+                for device in devices
+            ]
+            for task in futures.as_completed(tasks):
+                res = task.result()
                 if res != STATUS_SUCCESS:
-                    logging.warning(
-                        'Cannot restore the tunnel on device %s', deviceid
-                    )
+                    # Drop the restorations that have not started yet
+                    # and report the failure, as the sequential code
+                    # did
+                    for pending in tasks:
+                        pending.cancel()
                     return res
         # Success
         return STATUS_SUCCESS
 
     # Authenticate a device
     def authenticate_device(self, deviceid, auth_data):
-        logging.info('Authenticating the device %s' % deviceid)
+        logging.info('Authenticating the device %s', deviceid)
         # Get token
         token = auth_data.token
         # Authenticate the device
@@ -481,21 +752,29 @@ class PymerangController:
             deviceid, auth_data
         )
         if not authenticated:
-            logging.info('Authentication failed for the device %s' % deviceid)
-            return STATUS_UNAUTHORIZED, None, None
+            logging.info('Authentication failed for the device %s', deviceid)
+            return STATUS_UNAUTHORIZED, None, None, None
         # If the device is already registered, send it the configuration
         # and create tunnels
         if srv6_sdn_controller_state.device_exists(deviceid, tenantid):
-            logging.warning('The device %s is already registered' % deviceid)
+            logging.warning('The device %s is already registered', deviceid)
             srv6_sdn_controller_state.set_device_reconciliation_flag(
                 deviceid, tenantid, flag=True
             )
         else:
             # Update controller state
+            #
+            # The interfaces are materialized from the protobuf
+            # messages only here, right before the DB write; the
+            # already-registered path above skips the conversion
+            # entirely
             srv6_sdn_controller_state.register_device(
                 deviceid,
                 features,
-                interfaces,
+                [
+                    iface._asdict()
+                    for iface in _parse_interfaces(interfaces)
+                ],
                 mgmtip,
                 tenantid,
                 sid_prefix,
@@ -506,18 +785,27 @@ class PymerangController:
                 incoming_sr_transparency,
                 outgoing_sr_transparency
             )
+        # The device document has been created or updated on the DB
+        self.invalidate_device_cache(deviceid, tenantid)
         # Get the tenant configuration
         config = srv6_sdn_controller_state.get_tenant_config(tenantid)
         if config is None:
             logging.error(
                 'Tenant not found or error while connecting to the db'
             )
-            return STATUS_INTERNAL_ERROR, None, None
+            return STATUS_INTERNAL_ERROR, None, None, None
         # Set the port
         vxlan_port = config.get('vxlan_port', DEFAULT_VXLAN_PORT)
+        # Fetch the device state once, so the RPC handler does not need
+        # another lookup to fill the reply
+        device = self.get_device(deviceid, tenantid)
+        if device is None:
+            logging.error('Error getting device')
+            return STATUS_INTERNAL_ERROR, None, None, None
+        device_state = device.get('state', _DEVICE_STATE_UNKNOWN)
         # Success
-        logging.debug('New device registered:\n%s' % deviceid)
-        return STATUS_SUCCESS, vxlan_port, tenantid
+        logging.debug('New device registered:\n%s', deviceid)
+        return STATUS_SUCCESS, vxlan_port, tenantid, device_state
 
     def reconciliation_failed(self, deviceid, tenantid):
         logging.error('Reconciliation has failed for device %s.', deviceid)
@@ -529,6 +817,7 @@ class PymerangController:
             tenantid=tenantid,
             new_state=DeviceState.REBOOT_REQUIRED
         )
+        self.invalidate_device_cache(deviceid, tenantid)
         if success is False or success is None:
             logging.error('Error changing the device state')
             return status_codes_pb2.STATUS_INTERNAL_ERROR
@@ -552,6 +841,7 @@ class PymerangController:
                 tenantid=tenantid,
                 new_state=DeviceState.FAILURE
             )
+            self.invalidate_device_cache(deviceid, tenantid)
             if success is False or success is None:
                 logging.error('Error changing the device state')
                 return status_codes_pb2.STATUS_INTERNAL_ERROR
@@ -652,59 +942,95 @@ class PymerangController:
         # If a keep alive thread for the device is already running, we
         # need to stop it before starting new keep keep alive thread
         # to prevent race conditions
-        thread_id = f'{tenantid}/{deviceid}'
-        if self.connected_devices.get(thread_id) is not None:
-            self.connected_devices[thread_id].set()
+        key = (tenantid, deviceid)
+        entry = self.connected_devices.get(key)
+        if entry is not None:
+            entry.stop_event.set()
         # Create a new event, used to stop the Keep Alive procedure
         stop_event = Event()
-        self.connected_devices[f'{tenantid}/{deviceid}'] = stop_event
+        self.connected_devices[key] = ConnectedDevice(
+            stop_event=stop_event, tunnel_mode=tunnel_mode
+        )
         # Send a keep-alive messages to keep the tunnel opened,
         # if required for the tunnel mode
         # After N keep alive messages lost, we assume that the device
         # is not reachable, and we mark it as "not connected"
         if tunnel_mode.require_keep_alive_messages:
-            Thread(
-                target=utils.start_keep_alive_icmp,
-                args=(
+            # The monitor runs as a coroutine on the shared keep alive
+            # loop; the disconnect callback is handed over to the
+            # executor because it performs blocking controller-state
+            # operations
+            asyncio.run_coroutine_threadsafe(
+                utils.start_keep_alive_icmp_async(
                     mgmtip,
                     self.keep_alive_interval,
                     self.max_keep_alive_lost,
                     stop_event,
-                    lambda: self.device_disconnected(deviceid, tenantid)
+                    lambda: self.keep_alive_executor.submit(
+                        self.device_disconnected, deviceid, tenantid
+                    )
                 ),
-                daemon=False
-            ).start()
-        # Update controller state
-        success = srv6_sdn_controller_state.update_mgmt_info(
-            deviceid,
-            tenantid,
-            mgmtip,
-            interfaces,
-            tunnel_name,
-            nat_type,
-            device_external_ip,
-            device_external_port,
-            device_vtep_mac,
-            vxlan_port
-        )
-        if success is None or success is False:
-            err = (
-                'Cannot update tunnel management info. '
-                'Error while updating the controller state'
+                self.keep_alive_loop
             )
-            logging.error(err)
-            return STATUS_INTERNAL_ERROR, None, None, None, None
-        # Mark the device as "connected"
-        success = srv6_sdn_controller_state.set_device_connected_flag(
-            deviceid=deviceid, tenantid=tenantid, connected=True
-        )
-        if success is None or success is False:
-            err = (
-                'Cannot set the device as connected. '
-                'Error while updating the controller state'
+        # Update controller state; the interfaces are materialized
+        # from the protobuf messages only now that the tunnel has been
+        # created and the update is going to be persisted
+        ext_interfaces = _parse_ext_interfaces(interfaces)
+        if _finalize_mgmt_update is not None:
+            # Single DB write covering the management info, the
+            # connected flag and the WORKING state
+            success = _finalize_mgmt_update(
+                deviceid,
+                tenantid,
+                mgmtip,
+                ext_interfaces,
+                tunnel_name,
+                nat_type,
+                device_external_ip,
+                device_external_port,
+                device_vtep_mac,
+                vxlan_port,
+                connected=True,
+                new_state=DeviceState.WORKING
             )
-            logging.error(err)
-            return STATUS_INTERNAL_ERROR, None, None, None, None
+            if success is None or success is False:
+                err = (
+                    'Cannot update tunnel management info. '
+                    'Error while updating the controller state'
+                )
+                logging.error(err)
+                return STATUS_INTERNAL_ERROR, None, None, None, None
+        else:
+            success = srv6_sdn_controller_state.update_mgmt_info(
+                deviceid,
+                tenantid,
+                mgmtip,
+                ext_interfaces,
+                tunnel_name,
+                nat_type,
+                device_external_ip,
+                device_external_port,
+                device_vtep_mac,
+                vxlan_port
+            )
+            if success is None or success is False:
+                err = (
+                    'Cannot update tunnel management info. '
+                    'Error while updating the controller state'
+                )
+                logging.error(err)
+                return STATUS_INTERNAL_ERROR, None, None, None, None
+            # Mark the device as "connected"
+            success = srv6_sdn_controller_state.set_device_connected_flag(
+                deviceid=deviceid, tenantid=tenantid, connected=True
+            )
+            if success is None or success is False:
+                err = (
+                    'Cannot set the device as connected. '
+                    'Error while updating the controller state'
+                )
+                logging.error(err)
+                return STATUS_INTERNAL_ERROR, None, None, None, None
         # Update gRPC IP used by STAMP
         stamp_node = (
             self.nb_interface_ref.stamp_controller.storage.get_stamp_node(
@@ -715,16 +1041,19 @@ class PymerangController:
             self.nb_interface_ref.stamp_controller.storage.update_stamp_node(
                 node_id=deviceid, tenantid=tenantid, grpc_ip=mgmtip
             )
-        # Device registration and authentication completed successfully,
-        # now it is working
-        success = srv6_sdn_controller_state.change_device_state(
-            deviceid=deviceid,
-            tenantid=tenantid,
-            new_state=DeviceState.WORKING
-        )
-        if success is False or success is None:
-            logging.error('Error changing the device state')
-            return STATUS_INTERNAL_ERROR, None, None, None, None
+        if _finalize_mgmt_update is None:
+            # Device registration and authentication completed
+            # successfully, now it is working
+            success = srv6_sdn_controller_state.change_device_state(
+                deviceid=deviceid,
+                tenantid=tenantid,
+                new_state=DeviceState.WORKING
+            )
+            if success is False or success is None:
+                self.invalidate_device_cache(deviceid, tenantid)
+                logging.error('Error changing the device state')
+                return STATUS_INTERNAL_ERROR, None, None, None, None
+        self.invalidate_device_cache(deviceid, tenantid)
         # Success
         logging.debug('Updated management information: %s', deviceid)
         return (
@@ -735,18 +1064,35 @@ class PymerangController:
             vtep_mask
         )
 
-    def unregister_device(self, deviceid, tenantid):
-        logging.debug('Unregistering the device %s', deviceid)
-        # Get the device
-        device = srv6_sdn_controller_state.get_device(deviceid, tenantid)
+    # Resolve the tunnel mode of a device, preferring the object
+    # memoized in connected_devices at tunnel-setup time over a device
+    # lookup on the controller state; returns a status code and the
+    # tunnel mode (None when the device has no tunnel)
+    def _get_device_tunnel_mode(self, deviceid, tenantid):
+        entry = self.connected_devices.get((tenantid, deviceid))
+        if entry is not None:
+            return STATUS_SUCCESS, entry.tunnel_mode
+        # Device connected before this process started (or never
+        # connected); fall back to the controller state, through the
+        # short-TTL cache so a flapping device does not re-read its
+        # document on every disconnect
+        device = self.get_device(deviceid, tenantid)
         if device is None:
             logging.error('Device %s not found', deviceid)
-            return STATUS_INTERNAL_ERROR
-        # Get tunnel mode
+            return STATUS_INTERNAL_ERROR, None
         tunnel_mode = device['tunnel_mode']
+        if tunnel_mode is None:
+            return STATUS_SUCCESS, None
+        # Get the tunnel mode class from its name
+        return STATUS_SUCCESS, self.tunnel_state.tunnel_modes[tunnel_mode]
+
+    def unregister_device(self, deviceid, tenantid):
+        logging.debug('Unregistering the device %s', deviceid)
+        # Get tunnel mode
+        res, tunnel_mode = self._get_device_tunnel_mode(deviceid, tenantid)
+        if res != STATUS_SUCCESS:
+            return res
         if tunnel_mode is not None:
-            # Get the tunnel mode class from its name
-            tunnel_mode = self.tunnel_state.tunnel_modes[tunnel_mode]
             # Destroy the tunnel
             logging.debug(
                 'Trying to destroy the tunnel for the device %s', deviceid
@@ -765,11 +1111,10 @@ class PymerangController:
 
     def device_disconnected(self, deviceid, tenantid):
         logging.debug('The device %s has been disconnected', deviceid)
-        # Get the device
-        device = srv6_sdn_controller_state.get_device(deviceid, tenantid)
-        if device is None:
-            logging.error('Device %s not found', deviceid)
-            return STATUS_INTERNAL_ERROR
+        # Get tunnel mode
+        res, tunnel_mode = self._get_device_tunnel_mode(deviceid, tenantid)
+        if res != STATUS_SUCCESS:
+            return res
         # Mark the device as "not connected"
         success = srv6_sdn_controller_state.set_device_connected_flag(
             deviceid=deviceid, tenantid=tenantid, connected=False
@@ -781,11 +1126,7 @@ class PymerangController:
             )
             logging.error(err)
             return STATUS_INTERNAL_ERROR
-        # Get tunnel mode
-        tunnel_mode = device['tunnel_mode']
         if tunnel_mode is not None:
-            # Get the tunnel mode class from its name
-            tunnel_mode = self.tunnel_state.tunnel_modes[tunnel_mode]
             # Destroy the tunnel
             logging.debug(
                 'Trying to destroy the tunnel for the device %s', deviceid
@@ -801,45 +1142,87 @@ class PymerangController:
             srv6_sdn_controller_state.set_tunnel_mode(deviceid, tenantid, None)
         # Clear management information on the database
         srv6_sdn_controller_state.clear_mgmt_info(deviceid, tenantid)
-        # Remove keep alive stop event
-        thread_id = f'{tenantid}/{deviceid}'
-        del self.connected_devices[thread_id]
+        self.invalidate_device_cache(deviceid, tenantid)
+        # Remove keep alive stop event; pop() tolerates a concurrent
+        # removal (e.g. a re-registration racing the disconnect)
+        self.connected_devices.pop((tenantid, deviceid), None)
         # Success
-        logging.debug('Device disconnected: %s' % deviceid)
+        logging.debug('Device disconnected: %s', deviceid)
         return STATUS_SUCCESS
 
     def exec_reconciliation(self, deviceid, tenantid):
-       
+        # Serialize concurrent reconciliations of the same device: when
+        # a flapping device triggers several invocations, the followers
+        # block until the first finishes and then re-check the
+        # reconciliation flag, so they turn into a no-op if it
+        # committed and retry the sequence if it failed. The lock
+        # entries are refcounted so the table does not accumulate one
+        # lock per device ever reconciled
+        key = (tenantid, deviceid)
+        with self._recon_locks_lock:
+            entry = self._recon_locks.get(key)
+            if entry is None:
+                entry = self._recon_locks[key] = [Lock(), 0]
+            entry[1] += 1
+            lock = entry[0]
+        try:
+            with lock:
+                return self._exec_reconciliation(deviceid, tenantid)
+        finally:
+            with self._recon_locks_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._recon_locks.pop(key, None)
+
+    def _exec_reconciliation(self, deviceid, tenantid):
+        # Run one reconciliation pass; the caller holds the per-device
+        # lock
         if srv6_sdn_controller_state.get_device_reconciliation_flag(
                 deviceid=deviceid, tenantid=tenantid
         ):
-            
+
             with RollbackContext() as rollback:
                 rollback.push(
                     func=self.reconciliation_failed,
                     deviceid=deviceid,
                     tenantid=tenantid
                 )
-                res = (
-                    self.nb_interface_ref.prepare_db_for_device_reconciliation(
+                # Newer northbound interfaces expose
+                # reconcile_device_full, which runs the prepare /
+                # device / overlay steps and the flag reset in a
+                # single server-side procedure instead of one
+                # roundtrip each
+                reconcile_full = getattr(
+                    self.nb_interface_ref, 'reconcile_device_full', None
+                )
+                if reconcile_full is not None:
+                    res = reconcile_full(
                         deviceid=deviceid, tenantid=tenantid
                     )
-                )
-                if res != 200:
-                    return res
-                res = self.nb_interface_ref.device_reconciliation(
-                    deviceid=deviceid, tenantid=tenantid
-                )
-                if res != 200:
-                    return res
-                res = self.nb_interface_ref.overlay_reconciliation(
-                    deviceid=deviceid, tenantid=tenantid
-                )
-                if res != 200:
-                    return res
-                srv6_sdn_controller_state.set_device_reconciliation_flag(
-                    deviceid, tenantid, flag=False
-                )
+                    if res != 200:
+                        return res
+                else:
+                    res = self.nb_interface_ref \
+                        .prepare_db_for_device_reconciliation(
+                            deviceid=deviceid, tenantid=tenantid
+                        )
+                    if res != 200:
+                        return res
+                    res = self.nb_interface_ref.device_reconciliation(
+                        deviceid=deviceid, tenantid=tenantid
+                    )
+                    if res != 200:
+                        return res
+                    res = self.nb_interface_ref.overlay_reconciliation(
+                        deviceid=deviceid, tenantid=tenantid
+                    )
+                    if res != 200:
+                        return res
+                    srv6_sdn_controller_state \
+                        .set_device_reconciliation_flag(
+                            deviceid, tenantid, flag=False
+                        )
+                self.invalidate_device_cache(deviceid, tenantid)
                 # Success, commit all performed operations
                 rollback.commitAll()
         # Reconciliation successful, reset the failures counter
@@ -862,18 +1245,16 @@ class PymerangController:
         # Restore management interfaces, if any
         self.restore_mgmt_interfaces()
         # Start gRPC server
-        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-        pymerang_pb2_grpc.add_PymerangServicer_to_server(
-            PymerangServicer(self), server
-        )
-        if tunnel_utils.getAddressFamily(self.server_ip) == AF_INET6:
-            server_address = '[%s]:%s' % (self.server_ip, self.server_port)
-        elif tunnel_utils.getAddressFamily(self.server_ip) == AF_INET:
-            server_address = '%s:%s' % (self.server_ip, self.server_port)
-        else:
-            logging.error('Invalid server address %s' % self.server_ip)
+        # Registration payloads carry the full interface/subnet
+        # inventory of a device and grow with its size; compress the
+        # channel by default (clients advertising gzip get compressed
+        # replies, the others are served uncompressed)
+        server_address = self.server_address
+        if server_address is None:
+            logging.error('Invalid server address %s', self.server_ip)
             return
         # If secure mode is enabled, we need to create a secure endpoint
+        grpc_server_credentials = None
         if self.secure:
             # Read key and certificate
             with open(self.key, 'rb') as f:
@@ -884,20 +1265,76 @@ class PymerangController:
             grpc_server_credentials = grpc.ssl_server_credentials(
                 ((key, certificate,),)
             )
-            # Create a secure endpoint
-            server.add_secure_port(
-                server_address,
-                grpc_server_credentials
+        # SO_REUSEPORT lets several independent server instances bind
+        # the same address, spreading the accepts (and the per-server
+        # polling threads) across cores; the default is a single
+        # instance
+        for _ in range(max(1, self.num_servers)):
+            # A fixed-size pool bounds the number of concurrently
+            # running RPCs; maximum_concurrent_rpcs additionally
+            # bounds the queue of accepted-but-not-yet-served RPCs, so
+            # a registration burst is pushed back to the clients
+            # instead of growing the backlog without limit
+            # The keep alive streams get dedicated workers on top of
+            # grpc_workers: each open stream pins its worker for the
+            # lifetime of the device, and without the headroom a few
+            # hundred streaming devices would starve the unary RPCs
+            pool = futures.ThreadPoolExecutor(
+                max_workers=self.grpc_workers + MAX_KEEP_ALIVE_STREAMS,
+                thread_name_prefix='pymerang-grpc'
             )
-        else:
-            # Create an insecure endpoint
-            server.add_insecure_port(server_address)
-        # Start the loop for gRPC
+            server = grpc.server(
+                pool,
+                options=GRPC_SERVER_OPTIONS,
+                maximum_concurrent_rpcs=(
+                    self.grpc_workers * 2 + MAX_KEEP_ALIVE_STREAMS
+                ),
+                compression=self.compression
+            )
+            pymerang_pb2_grpc.add_PymerangServicer_to_server(
+                PymerangServicer(self), server
+            )
+            if grpc_server_credentials is not None:
+                # Create a secure endpoint
+                server.add_secure_port(
+                    server_address,
+                    grpc_server_credentials
+                )
+            else:
+                # Create an insecure endpoint
+                server.add_insecure_port(server_address)
+            server.start()
+            self.grpc_servers.append(server)
+            self.grpc_pools.append(pool)
         logging.info('Server started: listening on %s', server_address)
-        server.start()
-        # Wait for server termination
-        while True:
-            time.sleep(10)
+        # Stop on SIGTERM/SIGINT; when serve() runs embedded on a
+        # non-main thread the signal handlers cannot be installed and
+        # the embedding application drives the shutdown through
+        # stop_serving()
+        try:
+            signal.signal(signal.SIGTERM, self._handle_stop_signal)
+            signal.signal(signal.SIGINT, self._handle_stop_signal)
+        except ValueError:
+            pass
+        # Block until the server is stopped; unlike the previous
+        # sleep-poll loop this waits on a condition variable and does
+        # not wake up periodically
+        self._stop_serving.wait()
+        # Drain the in-flight RPCs before returning
+        for server in self.grpc_servers:
+            server.stop(grace=GRPC_STOP_GRACE).wait()
+        for pool in self.grpc_pools:
+            pool.shutdown(wait=True)
+        logging.info('Server stopped')
+
+    def _handle_stop_signal(self, signum, frame):
+        logging.info('Received signal %s, stopping the server', signum)
+        self._stop_serving.set()
+
+    # Stop the gRPC server; in-flight RPCs get GRPC_STOP_GRACE seconds
+    # to complete
+    def stop_serving(self):
+        self._stop_serving.set()
 
 
 # Parse options
@@ -964,6 +1401,32 @@ def parse_arguments():
         default=DEFAULT_KEY,
         help='Server key file'
     )
+    # Size of the thread pool serving the RPCs
+    parser.add_argument(
+        '-w',
+        '--grpc-workers',
+        dest='grpc_workers',
+        type=int,
+        default=GRPC_MAX_WORKERS,
+        help='Number of threads serving the gRPC requests'
+    )
+    # Number of gRPC server instances
+    parser.add_argument(
+        '-n',
+        '--num-servers',
+        dest='num_servers',
+        type=int,
+        default=DEFAULT_NUM_SERVERS,
+        help='Number of gRPC server instances sharing the listen address'
+    )
+    # Compression applied to the gRPC replies
+    parser.add_argument(
+        '--compression',
+        dest='compression',
+        choices=list(GRPC_COMPRESSION_ALGORITHMS),
+        default=DEFAULT_GRPC_COMPRESSION,
+        help='Compression applied to the gRPC replies'
+    )
     # Parse input parameters
     args = parser.parse_args()
     # Return the arguments
@@ -996,6 +1459,12 @@ if __name__ == '__main__':
     keep_alive_interval = args.keep_alive_interval
     # Max keep alive lost
     max_keep_alive_lost = args.max_keep_alive_lost
+    # Size of the gRPC thread pool
+    grpc_workers = args.grpc_workers
+    # Number of gRPC server instances
+    num_servers = args.num_servers
+    # Compression applied to the gRPC replies
+    compression = GRPC_COMPRESSION_ALGORITHMS[args.compression]
     # Start server
     controller = PymerangController(
         server_ip,
@@ -1004,6 +1473,9 @@ if __name__ == '__main__':
         max_keep_alive_lost,
         secure,
         key,
-        certificate
+        certificate,
+        grpc_workers=grpc_workers,
+        num_servers=num_servers,
+        compression=compression
     )
     controller.serve()
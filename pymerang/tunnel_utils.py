@@ -1,16 +1,39 @@
 #!/usr/bin/env python
 
 # General imports
+import atexit
+import functools
 import logging
 import socket
-import time
+import threading
 from ipaddress import IPv6Interface, IPv4Interface, AddressValueError
 # pyroute2 dependencies
+from pyroute2 import IPBatch
 from pyroute2 import IPRoute
 from pyroute2.netlink.rtnl import ndmsg
 from pyroute2.netlink.exceptions import NetlinkError
 
 
+# Shared pyroute2 instance, lazily initialized by get_ip_route()
+_ip_route = None
+# Lock protecting the initialization of the shared pyroute2 instance
+_ip_route_lock = threading.Lock()
+
+
+def get_ip_route():
+    # Return the shared pyroute2 instance; opening a netlink socket
+    # requires a socket()+bind() syscall sequence and the allocation of
+    # the pyroute2 parser state, so we do it once and reuse the socket
+    # across calls instead of paying that cost on every operation
+    global _ip_route
+    if _ip_route is None:
+        with _ip_route_lock:
+            if _ip_route is None:
+                _ip_route = IPRoute()
+                atexit.register(_ip_route.close)
+    return _ip_route
+
+
 def enable_interface(device):
     # Get pyroute2 instance
     with IPRoute() as ip_route:
@@ -34,32 +57,75 @@ def delete_interface(device):
     with IPRoute() as ip_route:
         # Get interface index
         ifindex = ip_route.link_lookup(ifname=device)[0]
-
-        #FIXME remove this logging
-        print("******************************************** ifname=device :  ",device)
-        print("******************************************** ifindex :  ",ifindex)
-        time.sleep(10)
-
+        logging.debug('Deleting interface %s (ifindex %s)', device, ifindex)
         # Delete link
         ip_route.link("del", index=ifindex)
 
 
+def get_ifindex(ip_route, device):
+    # Resolve the interface name to its index with a filtered
+    # RTM_GETLINK ("get" pushes the filter into the kernel, while
+    # link_lookup dumps all the links and filters them in userspace,
+    # which is much slower on hosts with many interfaces)
+    try:
+        return ip_route.link('get', ifname=device)[0]['index']
+    except NetlinkError:
+        # The kernel does not support the filtered get
+        # Fall back to the link dump
+        return ip_route.link_lookup(ifname=device)[0]
+
+
 def add_address(device, address, mask):
-    # Get pyroute2 instance
-    with IPRoute() as ip_route:
-        # Get interface index
-        ifindex = ip_route.link_lookup(ifname=device)[0]
-        # Add the address
-        ip_route.addr('add', index=ifindex, address=address, mask=mask)
+    # Get the shared pyroute2 instance
+    ip_route = get_ip_route()
+    # Get interface index
+    ifindex = get_ifindex(ip_route, device)
+    # Add the address
+    ip_route.addr('add', index=ifindex, address=address, mask=mask)
 
 
 def del_address(device, address, mask):
-    # Get pyroute2 instance
+    # Get the shared pyroute2 instance
+    ip_route = get_ip_route()
+    # Get interface index
+    ifindex = get_ifindex(ip_route, device)
+    # Delete the address
+    ip_route.addr('del', index=ifindex, address=address, mask=mask)
+
+
+def send_batch(batch, n_msgs):
+    # Push an assembled IPBatch to the kernel with a single sendto()
+    # and wait for the ACK of each of its n_msgs messages, so failures
+    # raise NetlinkError exactly like the unbatched helpers. A
+    # dedicated socket is used because the replies carry the batch's
+    # private sequence numbers: read on the shared socket they could
+    # be mistaken for replies to concurrent requests
     with IPRoute() as ip_route:
-        # Get interface index
-        ifindex = ip_route.link_lookup(ifname=device)[0]
-        # Add the address
-        ip_route.addr('del', index=ifindex, address=address, mask=mask)
+        ip_route.sendto(batch.batch, (0, 0))
+        acks = 0
+        while acks < n_msgs:
+            # get() raises the NetlinkError carried by a failed ACK
+            acks += len(ip_route.get())
+    batch.reset()
+
+
+def add_addresses(device, addresses):
+    # Assign a list of (address, mask) pairs to an interface
+    #
+    # The interface index is resolved once and the RTM_NEWADDR messages
+    # are assembled with IPBatch and pushed to the kernel with a single
+    # sendto(), instead of paying one netlink roundtrip per address
+    if not addresses:
+        return
+    ip_route = get_ip_route()
+    # Get interface index
+    ifindex = get_ifindex(ip_route, device)
+    # Assemble the batch
+    batch = IPBatch()
+    for address, mask in addresses:
+        batch.addr('add', index=ifindex, address=address, mask=mask)
+    # Send the batch to the kernel
+    send_batch(batch, len(addresses))
 
 
 def add_route(dst, gateway, dev, family):
@@ -167,6 +233,10 @@ def validate_ipv4_address(ip):
 
 
 # Utiliy function to get the IP address family
+# The result is memoized: the same addresses (controller IP, device
+# external IPs) are resolved over and over on the tunnel setup paths
+# and parsing the string each time is wasted work
+@functools.lru_cache(maxsize=4096)
 def getAddressFamily(ip):
     if validate_ipv6_address(ip):
         # IPv6 address
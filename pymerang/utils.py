@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 
 # General imports
+import asyncio
 import errno
 import logging
 import pynat
 import subprocess
 from ipaddress import ip_address, IPv6Network, IPv4Network
+from ipaddress import IPv4Address, IPv6Address
 from ipaddress import IPv4Interface, IPv6Interface, AddressValueError
 from urllib.parse import urlparse
 import grpc
@@ -127,7 +129,7 @@ def get_local_interfaces():
                         ipv6_addrs.append('%s/%s' % (addr, prefixlen))
                 else:
                     # Invalid address
-                    logging.error('Invalid address %s' % addr)
+                    logging.error('Invalid address %s', addr)
             # Save the interface
             interfaces[ifname] = {
                 'ifindex': ifindex,
@@ -170,6 +172,17 @@ def send_ping_raw(dst_ip):
     return process.returncode == 0
 
 
+# Send a single ICMP echo request without blocking the event loop
+async def send_ping_raw_async(dst_ip):
+    process = await asyncio.create_subprocess_exec(
+        'ping', '-c', '1', dst_ip,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    returncode = await process.wait()
+    return returncode == 0
+
+
 # Send a UDP message to the dst on the specified port
 def send_keep_alive_udp(dst_ip, dst_port):
     # Discover the address family
@@ -229,6 +242,48 @@ def start_keep_alive_icmp(dst_ip, interval=10, max_lost=0,
             time.sleep(interval)
 
 
+# Coroutine variant of start_keep_alive_icmp: many devices can be
+# monitored by a single event loop instead of one thread per device.
+# The stop_event is a threading.Event set from the gRPC handler
+# threads; it is checked once per keep alive cycle
+async def start_keep_alive_icmp_async(dst_ip, interval=10, max_lost=0,
+                                      stop_event=None, callback=None):
+    logging.info(
+        'Start sending ICMP keep alive messages to %s\n'
+        'Interval set to %s seconds (icmp)',
+        dst_ip,
+        interval
+    )
+    current_lost = 0
+    while True:
+        logging.debug('Send ICMP keep alive message')
+        is_reachable = await send_ping_raw_async(dst_ip)
+        if max_lost > 0:
+            if not is_reachable:
+                current_lost += 1
+                logging.warning(
+                    'Lost ICMP keep alive message (count %s)', current_lost
+                )
+                if current_lost >= max_lost:
+                    # Too many lost keep alive messages
+                    if callback is not None:
+                        logging.warning(
+                            'Too many lost ICMP keep alive messages\n'
+                        )
+                        return callback()
+                    return
+            else:
+                current_lost = 0
+        # Wait for X seconds before sending the next keep alive
+        await asyncio.sleep(interval)
+        if stop_event is not None and stop_event.is_set():
+            # Shutdown device operation requested
+            # Stop sending keep alive messages
+            logging.info('Termination flag set')
+            logging.info('Stop sending ICMP keep alive messages')
+            return
+
+
 # Start sending keep alive messages using UDP protocol
 def start_keep_alive_udp(dst_ip, dst_port, interval=30):
     logging.info(
@@ -268,6 +323,48 @@ def get_grpc_session(ip_address, port, secure=False, certificate=None):
     return channel
 
 
+# Act on the device state advertised by the controller in a keep alive
+# reply; shared by the streaming and the unary keep alive loops
+def check_device_state(response, stop_event=None, can_reboot=False):
+    if response.device_state == DEVICE_STATE_REBOOT_REQUIRED:
+        logging.info('The EveryEdge device needs to be restarted')
+        if can_reboot:
+            logging.info('Scheduling a restart in %s seconds', 30)
+            os.system('( sleep 30 ; reboot ) &')
+            exit(0)
+        else:
+            logging.info(
+                'Automatic reboot is disabled. Please reboot manually'
+            )
+        logging.info('Terminating EveryEdge.')
+        stop_event.set()
+    elif response.device_state == DEVICE_STATE_FAILURE:
+        logging.fatal(
+            'The controller detected too many failures on the device'
+        )
+        logging.fatal(
+            'Please remove the device from the EveryWAN GUI and '
+            'restart the EveryEdge'
+        )
+        logging.info('Terminating EveryEdge.')
+        stop_event.set()
+
+
+# Feed the keep alive stream: one request every `interval` seconds,
+# until the stop event (if any) is set
+def _keep_alive_stream_requests(grpc_request, interval, stop_event):
+    while True:
+        yield grpc_request
+        if stop_event is not None:
+            if stop_event.wait(timeout=interval) is True:
+                # Shutdown device operation requested; closing the
+                # generator half-closes the stream and the controller
+                # terminates the RPC
+                return
+        else:
+            time.sleep(interval)
+
+
 # Start sending keep alive messages using the gRPC channel
 def start_keep_alive_grpc(
     dst_ip,
@@ -302,12 +399,38 @@ def start_keep_alive_grpc(
         # grpc_request.device.id = self.deviceid
         # # Set the tenant ID
         # grpc_request.tenantid = self.tenantid
+        #
+        # Prefer the bidirectional KeepAliveStream RPC: all the keep
+        # alive messages travel over one long-lived stream, instead of
+        # paying the RPC setup once per message. If the controller does
+        # not support streaming (UNIMPLEMENTED) or has no stream slots
+        # left (RESOURCE_EXHAUSTED), fall back to the unary KeepAlive
+        try:
+            responses = grpc_stub.KeepAliveStream(
+                _keep_alive_stream_requests(
+                    grpc_request, interval, stop_event
+                )
+            )
+            for response in responses:
+                # Check the device state
+                check_device_state(response, stop_event, can_reboot)
+            # The request generator has completed: shutdown requested
+            logging.info('Termination flag set')
+            logging.info('Stop sending gRPC keep alive messages')
+            return
+        except grpc.RpcError as e:
+            logging.warning(
+                'Keep alive stream not available (%s), falling back '
+                'to unary keep alive messages', e.code()
+            )
         current_lost = 0
         while True:
             logging.debug('Send keep alive message on gRPC')
             try:
                 response = grpc_stub.KeepAlive(grpc_request)
                 current_lost = 0
+                # Check the device state
+                check_device_state(response, stop_event, can_reboot)
             except grpc.RpcError:  # as e:
                 logging.error(
                     'Controller did not reply to the keep alive gRPC'
@@ -320,29 +443,6 @@ def start_keep_alive_grpc(
                         )
                         return callback()
                     return
-            # Check the device state
-            if response.device_state == DEVICE_STATE_REBOOT_REQUIRED:
-                logging.info('The EveryEdge device needs to be restarted')
-                if can_reboot:
-                    logging.info('Scheduling a restart in %s seconds', 30)
-                    os.system('( sleep 30 ; reboot ) &')
-                    exit(0)
-                else:
-                    logging.info(
-                        'Automatic reboot is disabled. Please reboot manually'
-                    )
-                logging.info('Terminating EveryEdge.')
-                stop_event.set()
-            elif response.device_state == DEVICE_STATE_FAILURE:
-                logging.fatal(
-                    'The controller detected too many failures on the device'
-                )
-                logging.fatal(
-                    'Please remove the device from the EveryWAN GUI and '
-                    'restart the EveryEdge'
-                )
-                logging.info('Terminating EveryEdge.')
-                stop_event.set()
             # Wait for X seconds before sending the next keep alive
             if stop_event is not None:
                 # If shutdown device has been requested,
@@ -365,10 +465,14 @@ class IPv6AddressAllocator(object):
 
     def __init__(self):
         logging.debug('*** Calculating Available Private Nets')
-        self.hosts = (IPv6Network(self.net)).hosts()
+        self.baseAddress = int(IPv6Network(self.net).network_address)
+        # Rolling cursor: remember the last allocated host so that each
+        # allocation is a O(1) integer increment instead of a scan
+        self.lastAllocatedIndex = 0
 
     def nextAddress(self):
-        return next(self.hosts).__str__()
+        self.lastAllocatedIndex += 1
+        return str(IPv6Address(self.baseAddress + self.lastAllocatedIndex))
 
 
 # Allocates private IPv4 addresses
@@ -379,10 +483,14 @@ class IPv4AddressAllocator(object):
 
     def __init__(self):
         logging.debug('*** Calculating Available Private Nets')
-        self.hosts = (IPv4Network(self.net)).hosts()
+        self.baseAddress = int(IPv4Network(self.net).network_address)
+        # Rolling cursor: remember the last allocated host so that each
+        # allocation is a O(1) integer increment instead of a scan
+        self.lastAllocatedIndex = 0
 
     def nextAddress(self):
-        return next(self.hosts).__str__()
+        self.lastAllocatedIndex += 1
+        return str(IPv4Address(self.baseAddress + self.lastAllocatedIndex))
 
 
 # Allocates private IPv6 nets
@@ -394,11 +502,27 @@ class IPv6NetAllocator(object):
 
     def __init__(self):
         logging.debug('*** Calculating Available Private Nets')
-        self.subnets = (IPv6Network(self.net)).subnets(new_prefix=self.prefix)
+        self.baseAddress = int(IPv6Network(self.net).network_address)
+        self.netSize = 2 ** (128 - self.prefix)
+        # Rolling cursor: remember the last allocated net so that each
+        # allocation is a O(1) integer increment instead of a scan
+        self.lastAllocatedIndex = -1
+        # Indexes of released nets, reused before advancing the cursor
+        self.reusableIndexes = []
 
     def nextNet(self):
-        net = next(self.subnets)
-        return net.__str__()
+        if self.reusableIndexes:
+            index = self.reusableIndexes.pop()
+        else:
+            self.lastAllocatedIndex += 1
+            index = self.lastAllocatedIndex
+        address = self.baseAddress + index * self.netSize
+        return '%s/%d' % (IPv6Address(address), self.prefix)
+
+    def releaseNet(self, net):
+        address = int(IPv6Network(net).network_address)
+        self.reusableIndexes.append((address - self.baseAddress) //
+                                    self.netSize)
 
 
 # Allocates private IPv4 nets
@@ -410,11 +534,27 @@ class IPv4NetAllocator(object):
 
     def __init__(self):
         logging.debug('*** Calculating Available Private Nets')
-        self.subnets = (IPv4Network(self.net)).subnets(new_prefix=self.prefix)
+        self.baseAddress = int(IPv4Network(self.net).network_address)
+        self.netSize = 2 ** (32 - self.prefix)
+        # Rolling cursor: remember the last allocated net so that each
+        # allocation is a O(1) integer increment instead of a scan
+        self.lastAllocatedIndex = -1
+        # Indexes of released nets, reused before advancing the cursor
+        self.reusableIndexes = []
 
     def nextNet(self):
-        net = next(self.subnets)
-        return net.__str__()
+        if self.reusableIndexes:
+            index = self.reusableIndexes.pop()
+        else:
+            self.lastAllocatedIndex += 1
+            index = self.lastAllocatedIndex
+        address = self.baseAddress + index * self.netSize
+        return '%s/%d' % (IPv4Address(address), self.prefix)
+
+    def releaseNet(self, net):
+        address = int(IPv4Network(net).network_address)
+        self.reusableIndexes.append((address - self.baseAddress) //
+                                    self.netSize)
 
 
 # Return IP and port from a address encoded as string
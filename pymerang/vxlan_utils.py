@@ -4,9 +4,11 @@
 import pyroute2
 import logging
 import socket
+import threading
 import pynat
 # pyroute2 dependencies
-from pyroute2 import IPRoute
+from pyroute2 import IPBatch
+from pyroute2.netlink.rtnl import ndmsg
 from pyroute2.netlink.exceptions import NetlinkError
 # pymerang dependencies
 from pymerang import tunnel_utils
@@ -71,81 +73,132 @@ def create_vxlan(
     ageing SECONDS ] [ maxaddress NUMBER ] [ [no]external ] [ gbp ] [ gpe
     ]
     '''
-    # Get pyroute2 instance
-    with IPRoute() as ip_route:
-        # Get the interface index
-        if phys_dev is not None:
-            ifindex = ip_route.link_lookup(ifname=phys_dev)[0]
-        else:
-            ifindex = None
-        # Create the link
-        ip_route.link(
-            'add',
-            ifname=device,
-            kind='vxlan',
-            vxlan_id=vni,
-            vxlan_link=ifindex,
-            vxlan_group=remote,
-            vxlan_local=local,
-            vxlan_group6=remote6,
-            vxlan_local6=local6,
-            vxlan_ttl=ttl,
-            vxlan_tos=tos,
-            vxlan_label=flowlabel,
-            vxlan_port=dstport,
-            vxlan_port_range={
-                'low': srcport_min,
-                'high': srcport_max
-            },
-            vxlan_learning=learning,
-            vxlan_proxy=proxy,
-            vxlan_rsc=rsc,
-            vxlan_l2miss=l2miss,
-            vxlan_l3miss=l3miss,
-            vxlan_udp_csum=udpcsum,
-            vxlan_udp_zero_csum6_tx=udp6zerocsumtx,
-            vxlan_udp_zero_csum6_rx=udp6zerocsumrx,
-            vxlan_ageing=ageing,
-            vxlan_gbp=gbp,
-            vxlan_gpe=gpe
-        )
+    # Get the shared pyroute2 instance
+    ip_route = tunnel_utils.get_ip_route()
+    # Get the interface index
+    if phys_dev is not None:
+        ifindex = ip_route.link_lookup(ifname=phys_dev)[0]
+    else:
+        ifindex = None
+    # Create the link
+    ip_route.link(
+        'add',
+        ifname=device,
+        kind='vxlan',
+        vxlan_id=vni,
+        vxlan_link=ifindex,
+        vxlan_group=remote,
+        vxlan_local=local,
+        vxlan_group6=remote6,
+        vxlan_local6=local6,
+        vxlan_ttl=ttl,
+        vxlan_tos=tos,
+        vxlan_label=flowlabel,
+        vxlan_port=dstport,
+        vxlan_port_range={
+            'low': srcport_min,
+            'high': srcport_max
+        },
+        vxlan_learning=learning,
+        vxlan_proxy=proxy,
+        vxlan_rsc=rsc,
+        vxlan_l2miss=l2miss,
+        vxlan_l3miss=l3miss,
+        vxlan_udp_csum=udpcsum,
+        vxlan_udp_zero_csum6_tx=udp6zerocsumtx,
+        vxlan_udp_zero_csum6_rx=udp6zerocsumrx,
+        vxlan_ageing=ageing,
+        vxlan_gbp=gbp,
+        vxlan_gpe=gpe
+    )
+
+
+# Cache of ifname -> ifindex resolutions; an interface keeps its index
+# for its whole lifetime, so the FDB helpers pay the RTM_GETLINK
+# roundtrip once per interface instead of once per entry. Entries are
+# dropped by _invalidate_ifindex() when the interface is deleted.
+_IFINDEX_CACHE = dict()
+
+
+def _ifindex(ip_route, device):
+    ifindex = _IFINDEX_CACHE.get(device)
+    if ifindex is None:
+        ifindex = tunnel_utils.get_ifindex(ip_route, device)
+        _IFINDEX_CACHE[device] = ifindex
+    return ifindex
+
+
+def _invalidate_ifindex(device):
+    _IFINDEX_CACHE.pop(device, None)
 
 
 def create_fdb_entry(dst, lladdr, dev, port=VXLAN_DSTPORT):
-    # Get pyroute2 instance
-    with IPRoute() as ip_route:
-        # Replace the entry
-        ip_route.fdb(
-            'add',
-            ifindex=ip_route.link_lookup(ifname=dev)[0],
-            lladdr=lladdr,
-            dst=dst,
-            port=port
-        )
+    # Get the shared pyroute2 instance
+    ip_route = tunnel_utils.get_ip_route()
+    # Add the entry
+    ip_route.fdb(
+        'add',
+        ifindex=_ifindex(ip_route, dev),
+        lladdr=lladdr,
+        dst=dst,
+        port=port
+    )
 
 
 def update_fdb_entry(dst, lladdr, dev, port=None):
-    # Get pyroute2 instance
-    with IPRoute() as ip_route:
-        # Replace the entry
-        ip_route.fdb(
-            'replace',
-            ifindex=ip_route.link_lookup(ifname=dev)[0],
-            lladdr=lladdr,
-            dst=dst,
-            port=port
-        )
+    # Get the shared pyroute2 instance
+    ip_route = tunnel_utils.get_ip_route()
+    # Replace the entry
+    ip_route.fdb(
+        'replace',
+        ifindex=_ifindex(ip_route, dev),
+        lladdr=lladdr,
+        dst=dst,
+        port=port
+    )
 
 
 def remove_fdb_entry(lladdr, dev):
-    # Get pyroute2 instance
-    with IPRoute() as ip_route:
-        # Remove the entry
-        ip_route.fdb(
-            'del',
-            ifindex=ip_route.link_lookup(ifname=dev)[0],
-            lladdr=lladdr
-        )
+    # Get the shared pyroute2 instance
+    ip_route = tunnel_utils.get_ip_route()
+    # Remove the entry
+    ip_route.fdb(
+        'del',
+        ifindex=_ifindex(ip_route, dev),
+        lladdr=lladdr
+    )
+
+
+def install_device_endpoint(
+    dev,
+    device_external_ip,
+    device_external_port,
+    device_vtep_ip,
+    device_vtep_mac
+):
+    # Install the FDB entry and the IP neighbor entry of a device VTEP
+    # with a single netlink send: the two messages are assembled with
+    # IPBatch and pushed with one sendto(), halving the roundtrips of
+    # the per-device setup. Both messages use the replace semantics,
+    # so the helper is idempotent and also covers the update case
+    ip_route = tunnel_utils.get_ip_route()
+    ifindex = _ifindex(ip_route, dev)
+    batch = IPBatch()
+    batch.fdb(
+        'replace',
+        ifindex=ifindex,
+        lladdr=device_vtep_mac,
+        dst=device_external_ip,
+        port=device_external_port
+    )
+    batch.neigh(
+        'replace',
+        dst=device_vtep_ip,
+        lladdr=device_vtep_mac,
+        ifindex=ifindex,
+        state=ndmsg.states['permanent']
+    )
+    tunnel_utils.send_batch(batch, 2)
 
 
 def create_or_update_fdb_entry(dst, lladdr, dev, port=VXLAN_DSTPORT):
@@ -167,6 +220,22 @@ def create_or_update_fdb_entry(dst, lladdr, dev, port=VXLAN_DSTPORT):
         raise e
 
 
+# Dispatch table from address family to the management address
+# allocator of the controller state; built lazily because
+# storage_helper is only importable on the controller
+_MGMT_ALLOCATORS = None
+
+
+def _mgmt_allocator(family):
+    global _MGMT_ALLOCATORS
+    if _MGMT_ALLOCATORS is None:
+        _MGMT_ALLOCATORS = {
+            socket.AF_INET: storage_helper.get_new_mgmt_ipv4,
+            socket.AF_INET6: storage_helper.get_new_mgmt_ipv6
+        }
+    return _MGMT_ALLOCATORS.get(family)
+
+
 class TunnelVXLAN(tunnel_utils.TunnelMode):
 
     ''' VXLAN tunnel mode '''
@@ -182,8 +251,14 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
             pynat.RESTRICTED_CONE,
             pynat.RESTRICTED_PORT
         ]
-        # Initiated flag used by the controller
+        # Initiated flag used by the controller; the lock makes the
+        # one-time interface setup safe against concurrent first
+        # registrations
         self.initiated = False
+        self._init_lock = threading.Lock()
+        # Name of the VXLAN management interface; the VNI is constant,
+        # so compute the name once instead of on every call
+        self.vxlan_ifname = '%s-%s' % (name, MGMT_VNI)
         # Create tunnel mode
         super().__init__(
             name=name,
@@ -199,7 +274,7 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
         # VNI used for VXLAN management interface
         vni = MGMT_VNI
         # Create the VXLAN interface
-        vxlan_name = '%s-%s' % (self.name, vni)
+        vxlan_name = self.vxlan_ifname
         logging.debug(
             'Attempting to create the VXLAN '
             'interface %s with VNI %s',
@@ -218,7 +293,7 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
             learning=False
         )
         # Bring the interface UP
-        logging.debug('Bringing the interface %s up' % vxlan_name)
+        logging.debug('Bringing the interface %s up', vxlan_name)
         tunnel_utils.enable_interface(device=vxlan_name)
         # Include the VTEP's MAC address in the registration request
         # sent to the controller
@@ -242,10 +317,8 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
         controller_vtep_mac
     ):
         logging.info('Configuring the VXLAN management interface')
-        # VNI used for VXLAN management interface
-        vni = MGMT_VNI
         # Add a private address to the interface
-        vxlan_name = '%s-%s' % (self.name, vni)
+        vxlan_name = self.vxlan_ifname
         logging.debug(
             'Attempting to assign the IP address %s/%s '
             'to the VXLAN management interface %s',
@@ -302,7 +375,8 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
         device_external_ip,
         device_external_port,
         vxlan_port,
-        device_vtep_mac
+        device_vtep_mac,
+        preallocated=None
     ):
         logging.info(
             'Configuring the VXLAN tunnel for the device %s', deviceid
@@ -310,74 +384,74 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
         # Extract the tenant ID
         # tenantid = tunnel_info.tenantid
         # _tenantid = '0'
-        # VNI used for VXLAN management interface
-        vni = MGMT_VNI
         # Create the VXLAN interface
-        vxlan_name = '%s-%s' % (self.name, vni)
+        vxlan_name = self.vxlan_ifname
         # Save the MAC address of the device's VTEP
         storage_helper.update_device_vtep_mac(
             deviceid, tenantid, device_vtep_mac
         )
-        # Init VXLAN tunnel mode
+        # Init VXLAN tunnel mode; double-checked under the lock so two
+        # devices registering concurrently cannot both run the
+        # one-time interface setup
         if not self.initiated:
-            self.init_tunnel_controller_endpoint()
-            self.initiated = True
-        # Generate private address for the device VTEP
+            with self._init_lock:
+                if not self.initiated:
+                    self.init_tunnel_controller_endpoint()
+                    self.initiated = True
+        # Generate private address for the device VTEP; a caller
+        # onboarding devices in bulk can allocate the addresses
+        # upfront in one batch and hand each pair in as
+        # ('controller_ip/mask', 'device_ip/mask'), skipping the
+        # per-device allocator roundtrips
         family = tunnel_utils.getAddressFamily(device_external_ip)
-        if family == socket.AF_INET6:
-            ip_mask = storage_helper.get_new_mgmt_ipv6('0').split('/')
-            controller_vtep_ip = ip_mask[0]
-            ip_mask = storage_helper.get_new_mgmt_ipv6(deviceid).split('/')
+        if preallocated is not None:
+            controller_vtep_ip = preallocated[0].split('/')[0]
+            ip_mask = preallocated[1].split('/')
             device_vtep_ip = ip_mask[0]
             vtep_mask = int(ip_mask[1])
-        elif family == socket.AF_INET:
-            ip_mask = storage_helper.get_new_mgmt_ipv4('0').split('/')
+        else:
+            # The v4 and v6 arms of the old if/elif ladder were
+            # identical apart from the allocator; dispatch on the
+            # family through the table instead
+            get_new_mgmt_ip = _mgmt_allocator(family)
+            if get_new_mgmt_ip is None:
+                logging.error(
+                    'Invalid family address: %s', device_external_ip
+                )
+                # (status_code, controller_vtep_mac,
+                #      controller_vtep_ip, device_vtep_ip, vtep_mask)
+                return (
+                    status_codes_pb2.STATUS_INTERNAL_ERROR,
+                    None,
+                    None,
+                    None,
+                    None
+                )
+            ip_mask = get_new_mgmt_ip('0').split('/')
             controller_vtep_ip = ip_mask[0]
-            ip_mask = storage_helper.get_new_mgmt_ipv4(deviceid).split('/')
+            ip_mask = get_new_mgmt_ip(deviceid).split('/')
             device_vtep_ip = ip_mask[0]
             vtep_mask = int(ip_mask[1])
-        else:
-            logging.error(
-                'Invalid family address: %s', device_external_ip
-            )
-            # (status_code, controller_vtep_mac,
-            #      controller_vtep_ip, device_vtep_ip, vtep_mask)
-            return (
-                status_codes_pb2.STATUS_INTERNAL_ERROR,
-                None,
-                None,
-                None,
-                None
-            )
-        # Create a FDB entry that associate the device VTEP MAC address
-        # to the device IP address
+        # Create a FDB entry that associates the device VTEP MAC
+        # address to the device IP address and a IP neighbor entry
+        # that associates the VTEP IP address of the device to the
+        # device VTEP MAC address; both are pushed to the kernel with
+        # a single netlink send
         logging.debug(
-            'Attempting to add the entry to the FDB\n'
-            'dst=%s, lladdr=%s, vxlan_name=%s, port=%s',
+            'Attempting to add the FDB entry and the neigh\n'
+            'external_ip=%s, vtep_ip=%s, lladdr=%s, vxlan_name=%s, port=%s',
             device_external_ip,
+            device_vtep_ip,
             device_vtep_mac,
             vxlan_name,
             device_external_port
         )
-        create_or_update_fdb_entry(
+        install_device_endpoint(
             dev=vxlan_name,
-            lladdr=device_vtep_mac,
-            dst=device_external_ip,
-            port=device_external_port
-        )
-        # Create a IP neighbor entry that associate the VTEP IP address
-        # of the device to the device VTEP MAC address
-        logging.debug(
-            'Attempting to add the neigh to the neigh table\n'
-            'dst=%s, lladdr=%s, vxlan_name=%s',
-            device_vtep_ip,
-            device_vtep_mac,
-            vxlan_name
-        )
-        tunnel_utils.create_or_update_ip_neigh(
-            dev=vxlan_name,
-            lladdr=device_vtep_mac,
-            dst=device_vtep_ip
+            device_external_ip=device_external_ip,
+            device_external_port=device_external_port,
+            device_vtep_ip=device_vtep_ip,
+            device_vtep_mac=device_vtep_mac
         )
         # Update and return the tunnel info
         controller_vtep_mac = tunnel_utils.get_mac_address(ifname=vxlan_name)
@@ -415,10 +489,8 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
             'Destroying the VXLAN tunnel '
             '(destroy_tunnel_device_endpoint_end)'
         )
-        # VNI used for VXLAN management interface
-        vni = MGMT_VNI
         # Name of the VXLAN interface
-        vxlan_name = '%s-%s' % (self.name, vni)
+        vxlan_name = self.vxlan_ifname
         # Remove the IP neighbor entry that associates the VTEP IP address
         # of the controller to the VTEP MAC address
         logging.debug(
@@ -465,15 +537,16 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
         logging.info(
             'Destroying the VXLAN tunnel (destroy_tunnel_device_endpoint)'
         )
-        # VNI used for VXLAN management interface
-        vni = MGMT_VNI
         # Name of the VXLAN interface
-        vxlan_name = '%s-%s' % (self.name, vni)
+        vxlan_name = self.vxlan_ifname
         # Delete the VXLAN interface
         logging.debug(
             'Attempting to remove the VXLAN interface %s', vxlan_name
         )
         tunnel_utils.delete_interface(device=vxlan_name)
+        # The interface is gone; a future VXLAN interface with the same
+        # name will get a new ifindex
+        _invalidate_ifindex(vxlan_name)
         # Remove the VTEP IP addresses
         self.controller_mgmtip = None
         self.device_vtep_ip = None
@@ -491,10 +564,8 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
         # deviceid = deviceid
         # Extract the tenant ID
         # tenantid = tenantid
-        # VNI used for VXLAN management interface
-        vni = MGMT_VNI
         # Name of the VXLAN interface
-        vxlan_name = '%s-%s' % (self.name, vni)
+        vxlan_name = self.vxlan_ifname
         # Remove the IP neighbor entry that associate the VTEP IP address
         # of the device to the device VTEP MAC address
         device_vtep_ip = storage_helper.get_device_mgmtip(
@@ -510,9 +581,9 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
             tunnel_utils.remove_ip_neigh(dev=vxlan_name, dst=device_vtep_ip)
         except pyroute2.netlink.exceptions.NetlinkError as e:
             if e.code == NO_SUCH_FILE_OR_DIRECTORY:
-                logging.warning('Skipping remove_ip_neigh: %s' % e)
+                logging.warning('Skipping remove_ip_neigh: %s', e)
             else:
-                logging.error('Error in remove_ip_neigh: %s' % e)
+                logging.error('Error in remove_ip_neigh: %s', e)
                 return status_codes_pb2.STATUS_INTERNAL_ERROR
         # Remove the FDB entry that associate the device VTEP MAC address
         # to the device IP address
@@ -583,6 +654,26 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
         vxlan_port,
         device_vtep_mac
     ):
+        # Fast path: while the device VTEP MAC is unchanged, the VXLAN
+        # link, the allocated VTEP addresses and the neigh entry are
+        # all still valid and only the FDB entry has to point at the
+        # new external address/port; a full destroy+create would tear
+        # the link down and blip the management datapath
+        old_vtep_mac = storage_helper.get_device_vtep_mac(deviceid, tenantid)
+        if old_vtep_mac is not None and old_vtep_mac == device_vtep_mac:
+            logging.debug(
+                'The VTEP MAC of the device %s is unchanged, '
+                'updating the FDB entry in place',
+                deviceid
+            )
+            update_fdb_entry(
+                dst=device_external_ip,
+                lladdr=device_vtep_mac,
+                dev=self.vxlan_ifname,
+                port=device_external_port
+            )
+            return status_codes_pb2.STATUS_SUCCESS
+        # The VTEP MAC changed; rebuild the tunnel endpoint
         res = self.destroy_tunnel_controller_endpoint(deviceid, tenantid)
         if res == status_codes_pb2.STATUS_SUCCESS:
             res = self.create_tunnel_controller_endpoint(
@@ -590,7 +681,6 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
                 tenantid,
                 device_external_ip,
                 device_external_port,
-                device_vtep_mask,
                 vxlan_port,
                 device_vtep_mac
             )
@@ -603,7 +693,7 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
         # VNI used for VXLAN management interface
         vni = MGMT_VNI
         # Create the VXLAN interface
-        vxlan_name = '%s-%s' % (self.name, vni)
+        vxlan_name = self.vxlan_ifname
         # Generate private addresses for the controller VTEP
         # ip_mask = storage_helper.get_new_mgmt_ipv6(
         #    '0', tenantid).split('/')
@@ -637,7 +727,7 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
             learning=False
         )
         # Bring the interface UP
-        logging.debug('Bringing the interface %s up' % vxlan_name)
+        logging.debug('Bringing the interface %s up', vxlan_name)
         tunnel_utils.enable_interface(device=vxlan_name)
         # Add a private address to the interface
         logging.debug(
@@ -672,10 +762,8 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
     def destr_tunnel_controller_endpoint(self):
         # Tenant ID used to store management information
         tenantid = 0
-        # VNI used for VXLAN management interface
-        vni = MGMT_VNI
         # Create the VXLAN interface
-        vxlan_name = '%s-%s' % (self.name, vni)
+        vxlan_name = self.vxlan_ifname
         # Remove the address from the VTEP interface
         ip_mask = storage_helper.get_device_mgmtipv4(tenantid, '0').split('/')
         controller_vtep_ipv4 = ip_mask[0]
@@ -715,5 +803,8 @@ class TunnelVXLAN(tunnel_utils.TunnelMode):
             vxlan_name
         )
         tunnel_utils.remove_interface(device=vxlan_name)
+        # The interface is gone; a future VXLAN interface with the same
+        # name will get a new ifindex
+        _invalidate_ifindex(vxlan_name)
         # Success
         return status_codes_pb2.STATUS_SUCCESS
@@ -42,8 +42,9 @@ setup(
     install_requires=[
         'setuptools',
         'netifaces>=0.10.9',
-        'grpcio>=1.19.0',
-        'grpcio-tools>=1.19.0',
+        'grpcio>=1.23.0',
+        'grpcio-tools>=1.23.0',
+        'protobuf>=3.20.0',
         'python-pytun>=2.3.0',
         'tornado>=6.0.3',
         'websocket-client>=0.56.0',